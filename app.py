@@ -1,15 +1,28 @@
 import streamlit as st
-import firebase_admin
-from firebase_admin import credentials, firestore
+import streamlit.components.v1 as components
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
 from datetime import datetime, timezone, timedelta
-import hashlib
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from pathlib import Path
+import functools
+import html
 import time
+from string import Template
+
+from nitematch import buckets, chat, match_cards
+from nitematch.ann import DEFAULT_EXACT_BELOW, DEFAULT_PROBES, AnnConfig
+from nitematch.firebase import init_firestore
+from nitematch.magic_links import hash_email, link_document, link_url, new_token
+from nitematch.mailer import (
+    DEFAULT_POOL_SIZE, DEFAULT_QUEUE_SIZE, MAGIC_LINK_SUBJECT, EmailWorker, SmtpPool,
+    render_magic_link
+)
+from nitematch.match_store import (
+    bump_roster_version, get_roster_version, is_stale,
+    load_match_document, matches_from_document, save_matches
+)
+from nitematch.matching import FEATURE_ENCODING_VERSION, encode_features, feature_vector
+from nitematch.roster import DEFAULT_TTL_SECONDS, RosterCache
 
 # ================= PAGE CONFIG =================
 st.set_page_config(
@@ -17,288 +30,69 @@ st.set_page_config(
     page_icon="💘",
     layout="centered"
 )
+SCRIPT_START = time.perf_counter()
 
 # ================= ENHANCED GLOBAL STYLES =================
-def apply_styles(has_matches=False, is_countdown=False):
-    """Apply dynamic styles based on match status and unlock state"""
-    
-    if has_matches:
-        # 🌸 PINK GRADIENT THEME when matches are found! 💕
-        background = """
-        background:
+# The shared stylesheet is a static asset (static/nitematch.css) the browser
+# fetches once and caches; each rerun only sends the link and the theme
+STYLESHEET_PATH = Path(__file__).parent / "static" / "nitematch.css"
+STYLESHEET_URL = "app/static/nitematch.css"
+
+THEME_BACKGROUNDS = {
+    # 🌸 PINK GRADIENT THEME when matches are found! 💕
+    "matches": """
             radial-gradient(circle at 15% 15%, rgba(236,72,153,0.35), transparent 40%),
             radial-gradient(circle at 85% 20%, rgba(192,132,252,0.30), transparent 45%),
             radial-gradient(circle at 50% 85%, rgba(251,113,133,0.32), transparent 50%),
             radial-gradient(circle at 10% 75%, rgba(244,114,182,0.25), transparent 45%),
             radial-gradient(circle at 90% 60%, rgba(217,70,239,0.28), transparent 40%),
-            linear-gradient(135deg, #0f0514 0%, #1a0a1e 50%, #0f0514 100%);
-    """
-    elif is_countdown:
-        # COUNTDOWN THEME - Mysterious and anticipatory
-        background = """
-        background:
+            linear-gradient(135deg, #0f0514 0%, #1a0a1e 50%, #0f0514 100%)""",
+    # COUNTDOWN THEME - Mysterious and anticipatory
+    "countdown": """
             radial-gradient(circle at 20% 30%, rgba(139,92,246,0.3), transparent 50%),
             radial-gradient(circle at 80% 20%, rgba(236,72,153,0.25), transparent 55%),
             radial-gradient(circle at 50% 80%, rgba(59,130,246,0.28), transparent 50%),
             radial-gradient(circle at 15% 70%, rgba(168,85,247,0.22), transparent 45%),
             radial-gradient(circle at 85% 85%, rgba(244,114,182,0.20), transparent 40%),
-            linear-gradient(135deg, #0a0118 0%, #1a0520 25%, #0f0628 50%, #1a0520 75%, #0a0118 100%);
-    """
-    else:
-        # DEFAULT THEME - More aesthetic purples and cyans
-        background = """
-        background:
+            linear-gradient(135deg, #0a0118 0%, #1a0520 25%, #0f0628 50%, #1a0520 75%, #0a0118 100%)""",
+    # DEFAULT THEME - More aesthetic purples and cyans
+    "default": """
             radial-gradient(circle at 25% 25%, rgba(167,139,250,0.25), transparent 45%),
             radial-gradient(circle at 75% 15%, rgba(56,189,248,0.22), transparent 50%),
             radial-gradient(circle at 50% 75%, rgba(139,92,246,0.28), transparent 45%),
             radial-gradient(circle at 10% 60%, rgba(99,102,241,0.20), transparent 40%),
-            linear-gradient(135deg, #0a0118 0%, #0f0820 50%, #0a0118 100%);
-    """
-    
-    st.markdown(f"""
-<style>
-.stApp {{
-    {background}
-    color: white;
-    transition: background 1.5s ease-in-out;
-}}
-.block-container {{ max-width: 820px; padding-top: 2rem; }}
-.title {{
-    font-size: 3.5rem;
-    font-weight: 900;
-    text-align: center;
-    background: linear-gradient(90deg, #ff4fd8, #00ffe1, #ff4fd8);
-    background-size: 200% auto;
-    -webkit-background-clip: text;
-    -webkit-text-fill-color: transparent;
-    animation: gradient-shift 4s ease infinite;
-    margin-bottom: 0.5rem;
-}}
-
-@keyframes gradient-shift {{
-    0%, 100% {{ background-position: 0% center; }}
-    50% {{ background-position: 100% center; }}
-}}
-
-.subtitle {{
-    text-align: center;
-    font-size: 1.1rem;
-    opacity: 0.8;
-    margin-bottom: 2rem;
-    font-style: italic;
-}}
-
-.glass {{
-    background: rgba(12,12,22,0.88);
-    backdrop-filter: blur(18px);
-    border-radius: 24px;
-    padding: 28px;
-    margin-bottom: 24px;
-    border: 1px solid rgba(255,255,255,0.08);
-    box-shadow: 0 8px 32px rgba(0,0,0,0.3);
-}}
-
-.countdown-box {{
-    background: linear-gradient(135deg, rgba(139,92,246,0.2), rgba(236,72,153,0.2));
-    backdrop-filter: blur(20px);
-    border-radius: 28px;
-    padding: 40px;
-    margin: 30px 0;
-    border: 2px solid rgba(255,255,255,0.15);
-    box-shadow: 0 12px 40px rgba(139,92,246,0.3);
-    text-align: center;
-}}
-
-.countdown-title {{
-    font-size: 1.5rem;
-    font-weight: 700;
-    margin-bottom: 1.5rem;
-    background: linear-gradient(90deg, #ec4899, #8b5cf6);
-    -webkit-background-clip: text;
-    -webkit-text-fill-color: transparent;
-}}
-
-.countdown-timer {{
-    font-size: 3rem;
-    font-weight: 900;
-    margin: 20px 0;
-    text-shadow: 0 0 20px rgba(139,92,246,0.5);
-    animation: pulse-glow 2s ease-in-out infinite;
-}}
-
-@keyframes pulse-glow {{
-    0%, 100% {{ 
-        text-shadow: 0 0 20px rgba(139,92,246,0.5);
-        transform: scale(1);
-    }}
-    50% {{ 
-        text-shadow: 0 0 40px rgba(236,72,153,0.8), 0 0 60px rgba(139,92,246,0.6);
-        transform: scale(1.05);
-    }}
-}}
-
-.unlock-date {{
-    font-size: 1.2rem;
-    font-weight: 600;
-    color: #00ffe1;
-    margin-top: 1rem;
-}}
-
-.small-note {{ 
-    font-size: 0.85rem; 
-    opacity: 0.75;
-    line-height: 1.6;
-}}
-
-/* Enhanced button styling */
-.stButton button {{
-    background: linear-gradient(135deg, rgba(255,79,216,0.3), rgba(0,255,225,0.3));
-    border: 1px solid rgba(255,255,255,0.2);
-    border-radius: 12px;
-    color: white;
-    font-weight: 600;
-    transition: all 0.3s ease;
-    padding: 0.6rem 1.5rem;
-}}
-.stButton button:hover {{
-    background: linear-gradient(135deg, rgba(255,79,216,0.5), rgba(0,255,225,0.5));
-    border: 1px solid rgba(255,255,255,0.4);
-    transform: translateY(-2px);
-    box-shadow: 0 8px 20px rgba(255,79,216,0.3);
-}}
-
-/* Clean dividers */
-hr {{
-    border: none;
-    border-top: 1px solid rgba(255,255,255,0.1);
-    margin: 1.5rem 0;
-}}
-
-/* Match celebration animations */
-@keyframes pulse {{
-    0%, 100% {{ opacity: 0.6; transform: scale(1); }}
-    50% {{ opacity: 1; transform: scale(1.02); }}
-}}
-
-.match-glow {{
-    animation: pulse 2s ease-in-out infinite;
-}}
+            linear-gradient(135deg, #0a0118 0%, #0f0820 50%, #0a0118 100%)"""
+}
 
-@keyframes heartbeat {{
-    0%, 100% {{ transform: scale(1); }}
-    25% {{ transform: scale(1.15); }}
-    50% {{ transform: scale(1); }}
-}}
+@st.cache_resource
+def inline_stylesheet():
+    """The stylesheet as a <style> block, for servers without static serving"""
+    return f"<style>{STYLESHEET_PATH.read_text()}</style>"
 
-.match-header {{
-    font-size: 1.4rem;
-    font-weight: 700;
-    margin: 1.5rem 0 1rem;
-    background: linear-gradient(90deg, #ff4fd8, #00ffe1);
-    -webkit-background-clip: text;
-    -webkit-text-fill-color: transparent;
-    animation: heartbeat 1.5s ease-in-out;
-}}
-
-.match-card {{
-    background: rgba(255,255,255,0.05);
-    border-radius: 16px;
-    padding: 20px;
-    margin: 12px 0;
-    border: 1px solid rgba(255,255,255,0.1);
-    transition: all 0.3s ease;
-}}
-.match-card:hover {{
-    background: rgba(255,255,255,0.08);
-    border-color: rgba(255,79,216,0.4);
-    transform: translateY(-2px);
-}}
-
-.section-header {{
-    font-size: 1.15rem;
-    font-weight: 700;
-    margin: 1.5rem 0 1rem;
-    padding-left: 0.5rem;
-    border-left: 3px solid #ff4fd8;
-}}
-
-.info-box {{
-    background: rgba(0,255,225,0.1);
-    border: 1px solid rgba(0,255,225,0.3);
-    border-radius: 12px;
-    padding: 16px;
-    margin: 12px 0;
-}}
-
-.success-box {{
-    background: rgba(34,197,94,0.15);
-    border: 1px solid rgba(34,197,94,0.3);
-    border-radius: 12px;
-    padding: 20px;
-    margin: 16px 0;
-}}
-
-/* FIXED: Chat interface styles with proper flex layout */
-.chat-container {{
-    display: flex;
-    flex-direction: column;
-    gap: 10px;
-}}
-
-.chat-message {{
-    padding: 12px 16px;
-    border-radius: 16px;
-    margin: 8px 0;
-    max-width: 75%;
-    word-wrap: break-word;
-    display: inline-block;
-}}
-
-.chat-sent {{
-    background: linear-gradient(135deg, rgba(255,79,216,0.25), rgba(236,72,153,0.25));
-    border: 1px solid rgba(255,79,216,0.3);
-}}
-
-.chat-received {{
-    background: rgba(255,255,255,0.08);
-    border: 1px solid rgba(255,255,255,0.15);
-}}
-
-.chat-timestamp {{
-    font-size: 0.75rem;
-    opacity: 0.6;
-    margin-top: 4px;
-}}
-
-.unread-badge {{
-    background: #ff4fd8;
-    color: white;
-    padding: 2px 8px;
-    border-radius: 12px;
-    font-size: 0.8rem;
-    font-weight: 700;
-    margin-left: 8px;
-}}
-</style>
-""", unsafe_allow_html=True)
+def apply_styles(has_matches=False, is_countdown=False):
+    """Apply dynamic styles based on match status and unlock state"""
+    
+    if has_matches:
+        theme = "matches"
+    elif is_countdown:
+        theme = "countdown"
+    else:
+        theme = "default"
+    
+    if st.get_option("server.enableStaticServing"):
+        stylesheet = f'<link rel="stylesheet" href="{STYLESHEET_URL}">'
+    else:
+        stylesheet = inline_stylesheet()
+    st.markdown(
+        f"{stylesheet}<style>:root {{ --nitematch-background:{THEME_BACKGROUNDS[theme]}; }}</style>",
+        unsafe_allow_html=True
+    )
 
 # ================= FIREBASE INITIALIZATION =================
-if not firebase_admin._apps:
-    cred = credentials.Certificate({
-        "type": "service_account",
-        "project_id": st.secrets["firebase"]["project_id"],
-        "private_key_id": st.secrets["firebase"]["private_key_id"],
-        "private_key": st.secrets["firebase"]["private_key"],
-        "client_email": st.secrets["firebase"]["client_email"],
-        "client_id": st.secrets["firebase"]["client_id"],
-        "auth_uri": st.secrets["firebase"]["auth_uri"],
-        "token_uri": st.secrets["firebase"]["token_uri"],
-        "auth_provider_x509_cert_url": st.secrets["firebase"]["auth_provider_x509_cert_url"],
-        "client_x509_cert_url": st.secrets["firebase"]["client_x509_cert_url"]
-    })
-    firebase_admin.initialize_app(cred)
-
-db = firestore.client()
+@st.cache_resource
+def get_db():
+    """Firestore client, created on first data access and shared by every session"""
+    return init_firestore()
 
 # ================= SESSION STATE INITIALIZATION =================
 if "logged_in" not in st.session_state:
@@ -307,75 +101,87 @@ if "current_user" not in st.session_state:
     st.session_state.current_user = None
 if "active_chat" not in st.session_state:
     st.session_state.active_chat = None
-if "all_users_cache" not in st.session_state:
-    st.session_state.all_users_cache = None
-if "all_users_cache_time" not in st.session_state:
-    st.session_state.all_users_cache_time = None
 if "computed_matches_cache" not in st.session_state:
     st.session_state.computed_matches_cache = {}
 if "chat_messages_cache" not in st.session_state:
     st.session_state.chat_messages_cache = {}
+if "chat_windows" not in st.session_state:
+    st.session_state.chat_windows = {}
+if "message_times" not in st.session_state:
+    st.session_state.message_times = {}
 if "unread_counts_cache" not in st.session_state:
     st.session_state.unread_counts_cache = {}
+if "unread_checked_at" not in st.session_state:
+    st.session_state.unread_checked_at = time.monotonic()
+if "timings" not in st.session_state:
+    st.session_state.timings = {}
 
 # ================= CONFIGURATION =================
 SMTP_SERVER = st.secrets.get("smtp", {}).get("server", "smtp.gmail.com")
 SMTP_PORT = st.secrets.get("smtp", {}).get("port", 587)
 SMTP_EMAIL = st.secrets.get("smtp", {}).get("email", "")
 SMTP_PASSWORD = st.secrets.get("smtp", {}).get("password", "")
+SMTP_POOL_SIZE = st.secrets.get("smtp", {}).get("pool_size", DEFAULT_POOL_SIZE)
+SMTP_QUEUE_SIZE = st.secrets.get("smtp", {}).get("queue_size", DEFAULT_QUEUE_SIZE)
 BASE_URL = st.secrets.get("app", {}).get("base_url", "https://nitematch.streamlit.app")
+ROSTER_TTL_SECONDS = st.secrets.get("matching", {}).get("roster_ttl_seconds", DEFAULT_TTL_SECONDS)
+SNAPSHOT_DIR = st.secrets.get("matching", {}).get("snapshot_dir")  # see nitematch.snapshot
+# Optional LSH candidate search for multi-campus rosters (see nitematch.ann)
+ANN_CONFIG = AnnConfig(
+    n_probes=st.secrets.get("matching", {}).get("ann_probes", DEFAULT_PROBES),
+    exact_below=st.secrets.get("matching", {}).get("ann_exact_below", DEFAULT_EXACT_BELOW)
+) if st.secrets.get("matching", {}).get("ann", False) else None
+# Listener-backed chat: new messages are pushed and drawn every few seconds
+CHAT_REALTIME = st.secrets.get("chat", {}).get("realtime", True)
+CHAT_REFRESH_SECONDS = st.secrets.get("chat", {}).get("refresh_seconds", 2)
+# "buckets" stores new chats a bucket of messages per document (see nitematch.buckets)
+CHAT_BUCKETS = st.secrets.get("chat", {}).get("storage", "messages") == buckets.LAYOUT
+CHAT_BUCKET_SIZE = st.secrets.get("chat", {}).get("bucket_size", buckets.DEFAULT_BUCKET_SIZE)
+# Messages shown when a chat opens; "load older" widens the window by as many again
+CHAT_WINDOW = st.secrets.get("chat", {}).get("window", chat.PAGE_SIZE)
+CARD_TIMEOUT_SECONDS = st.secrets.get("app", {}).get("card_timeout_seconds", match_cards.DEFAULT_TIMEOUT_SECONDS)
+MATCH_LIST_REFRESH_SECONDS = st.secrets.get("app", {}).get("match_list_refresh_seconds", 30)
+# Shows each fragment's server time under it, and the full run's at the bottom
+SHOW_TIMINGS = st.secrets.get("app", {}).get("show_timings", False)
 
 # ================= HELPER FUNCTIONS =================
-def hash_email(email):
-    """Hash email for privacy"""
-    return hashlib.sha256(email.lower().strip().encode()).hexdigest()
+def timed(name):
+    """Record each run's server time in st.session_state.timings[name] (ms)"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                st.session_state.timings[name] = elapsed
+                if SHOW_TIMINGS:
+                    st.caption(f"⏱️ {name}: {elapsed:.1f} ms")
+        return wrapper
+    return decorate
 
 def bin_map(value, opt1, opt2):
     """Map binary question to 0 or 1"""
     return 0 if value == opt1 else 1
 
-def pad_to_length(arr, target_length, fill_value=0):
-    """
-    CRITICAL FIX: Pad or truncate array to target length.
-    This prevents dimension mismatch errors.
-    """
-    arr = list(arr)
-    if len(arr) < target_length:
-        arr.extend([fill_value] * (target_length - len(arr)))
-    elif len(arr) > target_length:
-        arr = arr[:target_length]
-    return arr
-
 # ================= OPTIMIZED FIRESTORE FUNCTIONS =================
 
-def fetch_users():
-    """Fetch all users with caching"""
-    if st.session_state.all_users_cache is not None:
-        return st.session_state.all_users_cache
-    
-    users_ref = db.collection("users")
-    docs = users_ref.stream()
-    
-    users = []
-    for doc in docs:
-        data = doc.to_dict()
-        data["id"] = doc.id
-        users.append(data)
-    
-    st.session_state.all_users_cache = users
-    st.session_state.all_users_cache_time = datetime.now(timezone.utc)
-    
-    return users
+@st.cache_resource
+def get_roster_cache():
+    """One roster cache per process, shared by every session"""
+    return RosterCache(get_db(), ttl_seconds=ROSTER_TTL_SECONDS, snapshot_dir=SNAPSHOT_DIR, ann=ANN_CONFIG)
 
-def invalidate_user_cache():
-    """Invalidate user cache"""
-    st.session_state.all_users_cache = None
-    st.session_state.all_users_cache_time = None
-    st.session_state.computed_matches_cache = {}
+def add_to_roster(user_id, user_data):
+    """
+    Fold a new registration into this process's roster and top-k lists.
+    Other processes pick it up on their next incremental roster refresh.
+    """
+    get_roster_cache().register(user_id, user_data)
 
 def fetch_user_by_email_hash(email_hash):
     """Fetch user by email hash using indexed query"""
-    users_ref = db.collection("users")
+    users_ref = get_db().collection("users")
     query = users_ref.where("email_hash", "==", email_hash).limit(1)
     docs = list(query.stream())
     
@@ -388,7 +194,7 @@ def fetch_user_by_email_hash(email_hash):
 
 def fetch_user_by_email_hash_and_alias(email_hash, alias):
     """Fetch user by email hash and alias using compound query"""
-    users_ref = db.collection("users")
+    users_ref = get_db().collection("users")
     query = users_ref.where("email_hash", "==", email_hash).where("alias", "==", alias).limit(1)
     docs = list(query.stream())
     
@@ -399,273 +205,412 @@ def fetch_user_by_email_hash_and_alias(email_hash, alias):
     data["id"] = docs[0].id
     return data
 
-def compute_matches(user, all_users):
+def compute_matches(user):
+    """
+    Live matches from the shared, incrementally maintained top-k lists.
+    Missing answers are auto-padded; unscorable profiles are skipped.
+    """
+    return get_roster_cache().top_matches(user)
+
+def load_matches(user):
     """
-    FIXED: Compute matches with lenient validation (auto-fixes data).
-    This prevents the "profile data incomplete" error.
+    Read the user's precomputed match document (see nitematch.precompute).
+    Missing or stale documents (late registrants) are recomputed live once
+    and written back, so the next login is a single-document read again.
     """
     user_id = user.get("id")
     
-    # Check cache first
     if user_id in st.session_state.computed_matches_cache:
         return st.session_state.computed_matches_cache[user_id]
     
-    # LENIENT FIX: Just check if answers exist, don't reject
-    if "answers" not in user or "psych" not in user["answers"] or "interest" not in user["answers"]:
-        st.session_state.computed_matches_cache[user_id] = []
-        return []
+    roster_version = get_roster_version(get_db())
+    match_doc = load_match_document(get_db(), user_id)
     
-    user_gender = user.get("gender")
-    
-    # LENIENT FIX: Auto-pad to expected lengths instead of rejecting
-    user_psych_raw = user["answers"].get("psych", [])
-    user_interest_raw = user["answers"].get("interest", [])
-    
-    user_psych = pad_to_length(user_psych_raw, 10, 3)  # Fill with middle value
-    user_interest = pad_to_length(user_interest_raw, 5, 0)
-    
-    # Filter opposite gender
-    opposite_gender = "Female" if user_gender == "Male" else "Male"
-    candidates = [u for u in all_users if u.get("gender") == opposite_gender and u.get("id") != user_id]
-    
-    if not candidates:
-        st.session_state.computed_matches_cache[user_id] = []
-        return []
-    
-    # Calculate similarity scores
-    scores = []
-    for candidate in candidates:
-        try:
-            # LENIENT FIX: Skip validation, just check if data exists
-            if "answers" not in candidate or "psych" not in candidate["answers"] or "interest" not in candidate["answers"]:
-                continue
-            
-            # LENIENT FIX: Auto-pad candidate data too
-            cand_psych_raw = candidate["answers"].get("psych", [])
-            cand_interest_raw = candidate["answers"].get("interest", [])
-            
-            cand_psych = pad_to_length(cand_psych_raw, 10, 3)
-            cand_interest = pad_to_length(cand_interest_raw, 5, 0)
-            
-            # Compute cosine similarity
-            vec_user = np.array(user_psych + user_interest, dtype=float).reshape(1, -1)
-            vec_cand = np.array(cand_psych + cand_interest, dtype=float).reshape(1, -1)
-            
-            score = cosine_similarity(vec_user, vec_cand)[0][0]
-            scores.append((candidate, score))
-            
-        except Exception as e:
-            # Silently skip problematic candidates
-            continue
-    
-    scores.sort(key=lambda x: x[1], reverse=True)
-    
-    # Apply gender-based limits
-    if user_gender == "Male":
-        top_matches = scores[:3]
+    if is_stale(match_doc, roster_version):
+        matches = compute_matches(user)
+        save_matches(get_db(), user_id, matches, roster_version)
     else:
-        top_matches = scores[:5]
-    
-    matches = [{"user": m[0], "score": m[1]} for m in top_matches]
+        matches = matches_from_document(match_doc)
     
     st.session_state.computed_matches_cache[user_id] = matches
     
     return matches
 
-def get_or_create_chat(user1_id, user2_id):
-    """Get or create chat with caching"""
-    chat_id = "_".join(sorted([user1_id, user2_id]))
-    
-    cache_key = f"chat_exists_{chat_id}"
-    if cache_key in st.session_state:
-        return chat_id
-    
-    chat_ref = db.collection("chats").document(chat_id)
-    chat_doc = chat_ref.get()
-    
-    if not chat_doc.exists:
-        chat_ref.set({
-            "participants": [user1_id, user2_id],
-            "created_at": firestore.SERVER_TIMESTAMP,
-            "last_message_at": firestore.SERVER_TIMESTAMP
-        })
-    
-    st.session_state[cache_key] = True
-    
-    return chat_id
+@st.cache_resource
+def get_card_executor():
+    """Bounded pool shared by every session's match-card loads"""
+    return match_cards.make_executor()
+
+def load_match_cards(matches, current_user_id):
+    """Match cards with display fields, chat existence and unread counts"""
+    cache = st.session_state.unread_counts_cache
+    cached_unread = {}
+    for match in matches:
+        chat_id = chat.chat_id_for(current_user_id, match["id"])
+        if f"{chat_id}_{current_user_id}" in cache:
+            cached_unread[chat_id] = cache[f"{chat_id}_{current_user_id}"]
+    
+    cards = match_cards.load_match_cards(
+        get_db(), get_roster_cache().display, get_card_executor(), current_user_id, matches,
+        cached_unread=cached_unread, timeout=CARD_TIMEOUT_SECONDS
+    )
+    
+    for card in cards:
+        if card["chat_exists"]:
+            get_known_chats().add(card["chat_id"])
+            # Chats without a document yet are re-checked next time
+            if card["unread"] is not None:
+                cache[f"{card['chat_id']}_{current_user_id}"] = card["unread"]
+    return cards
+
+@st.cache_resource
+def get_known_chats():
+    """Ids of chat documents known to exist, shared by every session"""
+    return set()
+
+@st.cache_resource
+def get_bucketed_chats():
+    """Ids of chats known to use bucket storage; a chat never switches back"""
+    return set()
+
+def is_bucketed(chat_id):
+    if not CHAT_BUCKETS:
+        return False
+    bucketed_chats = get_bucketed_chats()
+    if chat_id not in bucketed_chats and buckets.is_bucketed(get_db(), chat_id):
+        bucketed_chats.add(chat_id)
+    return chat_id in bucketed_chats
 
 def fetch_messages(chat_id, force_refresh=False):
-    """Fetch messages with caching"""
-    if not force_refresh and chat_id in st.session_state.chat_messages_cache:
-        return st.session_state.chat_messages_cache[chat_id]
-    
-    messages_ref = db.collection("chats").document(chat_id).collection("messages")
-    messages_query = messages_ref.order_by("timestamp", direction=firestore.Query.ASCENDING)
-    
-    messages = []
-    for doc in messages_query.stream():
-        data = doc.to_dict()
-        data["id"] = doc.id
-        messages.append(data)
-    
-    st.session_state.chat_messages_cache[chat_id] = messages
-    
+    """
+    Cached chat history, oldest first. The first call reads the newest page;
+    force_refresh appends only messages newer than the last cached one.
+    """
+    cache = st.session_state.chat_messages_cache
+    entry = cache.get(chat_id)
+
+    if entry is None:
+        bucketed = is_bucketed(chat_id)
+        if bucketed:
+            messages, cursor, has_more = buckets.fetch_page(get_db(), chat_id, bucket_size=CHAT_BUCKET_SIZE)
+        else:
+            messages, cursor, has_more = chat.fetch_page(get_db(), chat_id)
+        entry = {"messages": messages, "cursor": cursor, "has_more": has_more, "bucketed": bucketed}
+        cache[chat_id] = entry
+    elif force_refresh:
+        last = last_message_time(entry["messages"])
+        if last is None:
+            # Nothing cached to anchor the tail on; the newest page is just as cheap
+            del cache[chat_id]
+            return fetch_messages(chat_id)
+        store = buckets if entry["bucketed"] else chat
+        chat.merge_messages(entry["messages"], store.fetch_newer(get_db(), chat_id, last))
+
+    return entry["messages"]
+
+def last_message_time(messages):
+    """Newest server-confirmed timestamp; pending messages carry local times"""
+    return next(
+        (m["timestamp"] for m in reversed(messages) if m.get("timestamp") and not m.get("pending")),
+        None
+    )
+
+@st.cache_resource
+def get_chat_feeds():
+    """Process-wide snapshot listeners, one per open chat"""
+    return chat.ChatFeeds(get_db())
+
+def sync_chat_feed(chat_id):
+    """Cached history plus whatever the chat's listener has delivered since"""
+    messages = fetch_messages(chat_id)
+    last = last_message_time(messages)
+    bucketed = st.session_state.chat_messages_cache[chat_id]["bucketed"]
+    feed = get_chat_feeds().get(chat_id, since=last, bucketed=bucketed)
+    if last is not None and last < feed.since:
+        # The other participant started this feed after our last read
+        messages = fetch_messages(chat_id, force_refresh=True)
+
+    settled = {m["id"] for m in messages if not m.get("pending")}
+    incoming = [m for m in feed.messages() if m["id"] not in settled]
+    if st.session_state.chat_messages_cache[chat_id]["has_more"] and messages:
+        # The listener is shared and may predate our first page; anything
+        # older than it belongs to history "load older" hasn't reached yet
+        oldest = messages[0]["timestamp"]
+        incoming = [m for m in incoming if m["timestamp"] >= oldest]
+    chat.merge_messages(messages, incoming)
     return messages
 
+def load_older_messages(chat_id):
+    """Prepend the next older page of history to the cached chat"""
+    entry = st.session_state.chat_messages_cache.get(chat_id)
+    if entry is None or not entry["has_more"]:
+        return
+
+    if entry["bucketed"]:
+        older, cursor, has_more = buckets.fetch_page(
+            get_db(), chat_id, before=entry["cursor"], bucket_size=CHAT_BUCKET_SIZE
+        )
+    else:
+        older, cursor, has_more = chat.fetch_page(get_db(), chat_id, before=entry["cursor"])
+    known = {m["id"] for m in entry["messages"]}
+    entry["messages"][:0] = [m for m in older if m["id"] not in known]
+    entry["cursor"] = cursor
+    entry["has_more"] = has_more
+
+def chat_window(chat_id):
+    return st.session_state.chat_windows.get(chat_id, CHAT_WINDOW)
+
+def has_older_messages(chat_id):
+    """True if older messages are cached but outside the window, or not fetched yet"""
+    messages = fetch_messages(chat_id)
+    return len(messages) > chat_window(chat_id) or st.session_state.chat_messages_cache[chat_id]["has_more"]
+
+def show_older_messages(chat_id):
+    """Widen the transcript window, fetching older pages only when the cache runs short"""
+    window = chat_window(chat_id) + CHAT_WINDOW
+    st.session_state.chat_windows[chat_id] = window
+    entry = st.session_state.chat_messages_cache[chat_id]
+    while len(entry["messages"]) < window and entry["has_more"]:
+        load_older_messages(chat_id)
+
+def message_time(msg):
+    """Display timestamp, formatted once per message id"""
+    ts = msg.get("timestamp")
+    if not ts:
+        return "Just now"
+    times = st.session_state.message_times
+    if msg["id"] not in times:
+        times[msg["id"]] = ts.strftime("%b %d, %I:%M %p")
+    return times[msg["id"]]
+
+def transcript_html(messages, current_user_id):
+    """The whole transcript as one HTML block, so a rerun sends a single element"""
+    # Blank lines would end the HTML block and hand the rest to markdown
+    rows = []
+    for msg in messages:
+        is_sent = msg["sender_id"] == current_user_id
+        css_class = "chat-sent" if is_sent else "chat-received"
+        # FIXED: Proper message alignment using div with text-align
+        align_style = "text-align:right;" if is_sent else "text-align:left;"
+        # One payload now, so an unclosed tag would swallow every later message
+        text = html.escape(msg["text"]).replace("\n", "<br>")
+        rows.append(
+            f'<div style="{align_style}"><div class="chat-message {css_class}">'
+            f'<div>{text}</div><div class="chat-timestamp">{message_time(msg)}</div>'
+            f'</div></div>'
+        )
+    return '<div class="chat-container">' + "".join(rows) + '</div>'
+
 def send_message(chat_id, sender_id, text):
-    """Send message and invalidate cache"""
-    message_data = {
-        "sender_id": sender_id,
-        "text": text,
-        "timestamp": firestore.SERVER_TIMESTAMP,
-        "read": False
-    }
-    
-    db.collection("chats").document(chat_id).collection("messages").add(message_data)
-    
-    db.collection("chats").document(chat_id).update({
-        "last_message_at": firestore.SERVER_TIMESTAMP
-    })
-    
-    if chat_id in st.session_state.chat_messages_cache:
-        del st.session_state.chat_messages_cache[chat_id]
-    
-    st.session_state.unread_counts_cache = {}
+    """
+    Write the message and chat metadata atomically, then append it to the
+    cached history as pending until the server copy arrives
+    """
+    # max_chars is only enforced in the browser
+    text = text[:chat.MAX_MESSAGE_CHARS]
+    known_chats = get_known_chats()
+    if CHAT_BUCKETS:
+        # One transaction: the hot bucket's fill level lives on the chat document
+        message = buckets.send_message(get_db(), chat_id, sender_id, text, bucket_size=CHAT_BUCKET_SIZE)
+    else:
+        batch, message_ref = chat.message_batch(
+            get_db(), chat_id, sender_id, text, new_chat=chat_id not in known_chats
+        )
+        write_results = batch.commit()
+        message = {
+            "id": message_ref.id,
+            "sender_id": sender_id,
+            "text": text,
+            # Commit time is what SERVER_TIMESTAMP resolves to
+            "timestamp": write_results[0].update_time
+        }
+    known_chats.add(chat_id)
+    
+    entry = st.session_state.chat_messages_cache.get(chat_id)
+    if entry is not None:
+        entry["messages"].append({**message, "pending": True})
 
-def get_unread_count(chat_id, current_user_id):
-    """Get count of unread messages for current user (no composite index needed)"""
-    cache_key = f"{chat_id}_{current_user_id}"
+def mark_messages_read(chat_id, current_user_id):
+    """Advance the reader's watermark and reset their counter in one write"""
+    try:
+        get_db().collection("chats").document(chat_id).update({
+            f"last_read_at.{current_user_id}": firestore.SERVER_TIMESTAMP,
+            f"unread.{current_user_id}": 0
+        })
+    except NotFound:
+        # Nobody has written yet; the chat is created with the first message
+        pass
     
+    cache_key = f"{chat_id}_{current_user_id}"
     if cache_key in st.session_state.unread_counts_cache:
-        return st.session_state.unread_counts_cache[cache_key]
-    
-    messages_ref = db.collection("chats").document(chat_id).collection("messages")
-    
-    # Query only unread messages (single-field index, usually auto-created)
-    unread_query = messages_ref.where("read", "==", False)
+        del st.session_state.unread_counts_cache[cache_key]
+
+@st.fragment(run_every=CHAT_REFRESH_SECONDS if CHAT_REALTIME else None)
+@timed("chat transcript")
+def render_transcript(chat_id, current_user_id):
+    """Chat messages; in real-time mode this fragment alone reruns on a timer"""
+    if CHAT_REALTIME:
+        messages = sync_chat_feed(chat_id)
+    else:
+        # Tail fetch: only messages newer than the cached ones are read
+        messages = fetch_messages(chat_id, force_refresh=True)
+    
+    if not messages:
+        body = """
+        <div style="text-align:center;padding:3rem;opacity:0.6;">
+            <div style="font-size:2rem;margin-bottom:1rem;">💬</div>
+            <div>No messages yet. Start the conversation!</div>
+        </div>
+        """.strip()
+    else:
+        body = transcript_html(messages[-chat_window(chat_id):], current_user_id)
+    
+    # FIXED: Chat messages container with proper scrolling and padding
+    st.markdown(
+        '<div class="glass" style="min-height:400px;max-height:500px;overflow-y:auto;padding:20px;margin-bottom:1rem;">'
+        + body + '</div>',
+        unsafe_allow_html=True
+    )
+
+@st.fragment(run_every=MATCH_LIST_REFRESH_SECONDS)
+@timed("match list")
+def render_match_list(current_user):
+    """Match cards; reruns on its own to refresh unread badges"""
+    now = time.monotonic()
+    if now - st.session_state.unread_checked_at > MATCH_LIST_REFRESH_SECONDS:
+        st.session_state.unread_counts_cache = {}
+        st.session_state.unread_checked_at = now
     
-    # Filter out current user's messages in Python (not in Firestore)
-    unread_count = 0
-    for msg in unread_query.stream():
-        msg_data = msg.to_dict()
-        if msg_data.get("sender_id") != current_user_id:
-            unread_count += 1
+    matches = load_match_cards(load_matches(current_user), current_user["id"])
     
-    st.session_state.unread_counts_cache[cache_key] = unread_count
+    st.markdown(f"""
+    <div class="match-header">
+        🎉 Your Top {len(matches)} Match{"es" if len(matches) > 1 else ""}
+    </div>
+    """, unsafe_allow_html=True)
     
-    return unread_count
+    for idx, match in enumerate(matches, 1):
+        match_user = match["user"]
+        score = match["score"]
+        
+        chat_id = match["chat_id"]
+        unread = match["unread"] or 0
+        
+        # Use a container to group the match card and button
+        with st.container():
+            unread_badge = f"<span class='unread-badge'>{unread} new</span>" if unread > 0 else ""
+            
+            st.markdown(f"""
+            <div class="match-card">
+                <div style="display:flex;justify-content:space-between;align-items:center;">
+                    <div>
+                        <div style="font-size:1.2rem;font-weight:700;">Match #{idx}: {match_user.get('alias')}</div>
+                        <div class="small-note">Compatibility: {score*100:.1f}%</div>
+                    </div>
+                    <div>{unread_badge}</div>
+                </div>
+            </div>
+            """, unsafe_allow_html=True)
+            
+            # Show match message if exists
+            if match_user.get("match_message"):
+                st.markdown(f"""
+                <div style="margin-top:0.8rem;padding:10px;background:rgba(255,255,255,0.03);border-radius:8px;border:1px solid rgba(255,255,255,0.1);font-style:italic;">
+                    "{match_user['match_message']}"
+                </div>
+                """, unsafe_allow_html=True)
+            
+            # Show Instagram if shared
+            if match_user.get("share_instagram") and match_user.get("instagram"):
+                st.markdown(f"""
+                <div style="margin-top:0.5rem;padding:10px;background:rgba(255,255,255,0.03);border-radius:8px;border:1px solid rgba(255,255,255,0.1);">
+                    📸 Instagram: <a href="https://instagram.com/{match_user['instagram'].replace('@','')}" 
+                       style="color:#00ffe1;text-decoration:none;" target="_blank">
+                       {match_user['instagram']}
+                    </a>
+                </div>
+                """, unsafe_allow_html=True)
+            
+            # Chat button
+            if st.button(f"💬 Chat with {match_user.get('alias')}", key=f"chat_{match_user['id']}"):
+                st.session_state.active_chat = {
+                    "chat_id": chat_id,
+                    "match_id": match_user["id"]
+                }
+                mark_messages_read(chat_id, current_user["id"])
+                # Switching views needs the whole page
+                st.rerun()
+            
+            # Add spacing between matches
+            st.markdown("<div style='margin-bottom:1.5rem;'></div>", unsafe_allow_html=True)
 
-def mark_messages_read(chat_id, current_user_id):
-    """Mark messages as read in batch (no composite index needed)"""
-    messages_ref = db.collection("chats").document(chat_id).collection("messages")
+@st.fragment
+@timed("chat panel")
+def render_chat_panel(current_user):
+    """Active chat; sending and paging rerun only this fragment"""
+    active_chat = st.session_state.active_chat
+    chat_id = active_chat["chat_id"]
+    match_user = get_roster_cache().display.get(active_chat["match_id"]) or {}
     
-    # Query only unread messages (single-field index)
-    unread_query = messages_ref.where("read", "==", False)
+    st.markdown(f"""
+    <div class="glass">
+        <div style="display:flex;justify-content:space-between;align-items:center;">
+            <div style="font-size:1.3rem;font-weight:700;">💬 Chat with {match_user.get('alias')}</div>
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
     
-    batch = db.batch()
-    for doc in unread_query.stream():
-        # Filter out current user's messages in Python
-        msg_data = doc.to_dict()
-        if msg_data.get("sender_id") != current_user_id:
-            batch.update(doc.reference, {"read": True})
+    if st.button("⬅️ Back to Matches"):
+        st.session_state.active_chat = None
+        # Switching views needs the whole page
+        st.rerun()
     
-    batch.commit()
+    if has_older_messages(chat_id) and st.button("⬆️ Load older messages"):
+        show_older_messages(chat_id)
+        st.rerun(scope="fragment")
     
-    cache_key = f"{chat_id}_{current_user_id}"
-    if cache_key in st.session_state.unread_counts_cache:
-        del st.session_state.unread_counts_cache[cache_key]
+    render_transcript(chat_id, current_user["id"])
+    
+    # FIXED: Message input form with cleaner positioning
+    st.markdown('<div style="margin-top:1rem;">', unsafe_allow_html=True)
+    with st.form("message_form", clear_on_submit=True):
+        msg_text = st.text_input("Type a message...", key="msg_input", label_visibility="collapsed",
+                                 max_chars=chat.MAX_MESSAGE_CHARS)
+        send_btn = st.form_submit_button("📤 Send", use_container_width=True)
+        
+        if send_btn and msg_text.strip():
+            send_message(chat_id, current_user["id"], msg_text.strip())
+            # Only this panel reruns; matching and styling are left alone
+            st.rerun(scope="fragment")
+    st.markdown('</div>', unsafe_allow_html=True)
 
 # ================= MAGIC LINK FUNCTIONS =================
 def create_magic_link(email_hash, email):
     """Generate a secure token and store in Firestore"""
-    token = secrets.token_urlsafe(32)
-    expiry = datetime.now(timezone.utc) + timedelta(hours=24)
-    
-    db.collection("magic_links").document(token).set({
-        "email_hash": email_hash,
-        "email": email,
-        "created_at": firestore.SERVER_TIMESTAMP,
-        "expires_at": expiry,
-        "used": False
-    })
+    token = new_token()
+    get_db().collection("magic_links").document(token).set(link_document(email_hash, email))
     
     return token
 
+@st.cache_resource
+def get_mailer():
+    """Process-wide email queue and its SMTP connection pool"""
+    pool = SmtpPool(SMTP_SERVER, SMTP_PORT, SMTP_EMAIL, SMTP_PASSWORD, size=SMTP_POOL_SIZE)
+    return EmailWorker(pool, SMTP_EMAIL, queue_size=SMTP_QUEUE_SIZE, workers=SMTP_POOL_SIZE)
+
 def send_magic_link(email, token):
-    """Send magic link via email using SMTP"""
+    """Queue the magic link email; delivery happens on a background worker"""
     
     if not SMTP_EMAIL or not SMTP_PASSWORD:
         st.error("⚠️ Email not configured. Please set up SMTP credentials.")
         return False
     
-    try:
-        magic_link = f"{BASE_URL}/?token={token}"
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = "🔐 Your NITeMatch Login Link"
-        msg['From'] = SMTP_EMAIL
-        msg['To'] = email
-        
-        html = f"""
-        <html>
-        <body style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; margin: 0; padding: 0; background-color: #0a0118;">
-            <table width="100%" cellpadding="0" cellspacing="0" style="background: linear-gradient(135deg, #0a0118 0%, #1a0520 50%, #0a0118 100%); padding: 40px 20px;">
-                <tr>
-                    <td align="center">
-                        <table width="600" cellpadding="0" cellspacing="0" style="background: rgba(20,20,40,0.95); border-radius: 24px; overflow: hidden; border: 1px solid rgba(255,255,255,0.1);">
-                            <tr>
-                                <td style="padding: 40px; text-align: center;">
-                                    <h1 style="margin: 0 0 10px 0; font-size: 2.5rem; background: linear-gradient(90deg, #ff4fd8, #00ffe1); -webkit-background-clip: text; -webkit-text-fill-color: transparent; background-clip: text;">
-                                        💘 NITeMatch
-                                    </h1>
-                                    <p style="margin: 0 0 30px 0; color: #a0a0a0; font-size: 1rem;">Your matches are waiting!</p>
-                                    
-                                    <div style="background: rgba(139,92,246,0.2); border-radius: 16px; padding: 30px; margin: 20px 0;">
-                                        <p style="color: white; font-size: 1.1rem; margin: 0 0 20px 0;">
-                                            Click the button below to access your account:
-                                        </p>
-                                        <a href="{magic_link}" style="display: inline-block; background: linear-gradient(135deg, #ff4fd8, #00ffe1); color: white; text-decoration: none; padding: 16px 40px; border-radius: 12px; font-weight: 600; font-size: 1.1rem; margin: 10px 0;">
-                                            🔓 Login to NITeMatch
-                                        </a>
-                                    </div>
-                                    
-                                    <div style="background: rgba(255,255,255,0.05); border-radius: 12px; padding: 20px; margin: 20px 0;">
-                                        <p style="color: #a0a0a0; font-size: 0.9rem; margin: 0;">
-                                            🔒 This link expires in 24 hours<br>
-                                            For security, don't share this link with anyone
-                                        </p>
-                                    </div>
-                                    
-                                    <p style="color: #707070; font-size: 0.85rem; margin: 30px 0 0 0; line-height: 1.6;">
-                                        If you didn't request this login, you can safely ignore this email.<br>
-                                        This is an automated message from NITeMatch.
-                                    </p>
-                                </td>
-                            </tr>
-                        </table>
-                    </td>
-                </tr>
-            </table>
-        </body>
-        </html>
-        """
-        
-        msg.attach(MIMEText(html, 'html'))
-        
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_EMAIL, SMTP_PASSWORD)
-            server.send_message(msg)
-        
-        return True
-        
-    except Exception as e:
-        st.error(f"Email error: {str(e)}")
-        return False
+    html = render_magic_link(link_url(BASE_URL, token))
+    return get_mailer().enqueue(email, MAGIC_LINK_SUBJECT, html)
 
 def verify_magic_link(token):
     """Verify magic link token"""
-    doc_ref = db.collection("magic_links").document(token)
+    doc_ref = get_db().collection("magic_links").document(token)
     doc = doc_ref.get()
     
     if not doc.exists:
@@ -700,6 +645,38 @@ def is_unlocked():
     """Check if matches are unlocked"""
     return datetime.now(IST) >= UNLOCK_TIME
 
+# Ticks the server-rendered countdown in the browser, so nobody has to
+# refresh (and rerun the script) to watch it; reloads once unlock arrives
+COUNTDOWN_SCRIPT = Template("""
+<script>
+const unlockAt = $unlock_ms;
+const skew = $server_ms - Date.now();
+const jitter = Math.random() * 5000;  // spread the reloads at unlock
+const doc = window.parent.document;
+
+function tick() {
+    const left = unlockAt - (Date.now() + skew);
+    if (left <= -jitter) {
+        window.parent.location.reload();
+        return;
+    }
+    const total = Math.max(Math.floor(left / 1000), 0);
+    const text = Math.floor(total / 86400) + "d " + Math.floor(total % 86400 / 3600) + "h "
+        + Math.floor(total % 3600 / 60) + "m " + total % 60 + "s";
+    doc.querySelectorAll(".countdown-timer").forEach(el => { el.textContent = text; });
+}
+tick();
+setInterval(tick, 1000);
+</script>
+""")
+
+def tick_countdown():
+    """Start the client-side countdown; no reruns or Firestore reads involved"""
+    components.html(COUNTDOWN_SCRIPT.substitute(
+        unlock_ms=int(UNLOCK_TIME.timestamp() * 1000),
+        server_ms=int(time.time() * 1000)
+    ), height=0)
+
 def get_countdown():
     """Get time remaining until unlock"""
     now = datetime.now(IST)
@@ -731,8 +708,7 @@ if "token" in query_params and not st.session_state.logged_in:
 if st.session_state.logged_in and st.session_state.current_user:
     current_user = st.session_state.current_user
     
-    all_users = fetch_users()
-    matches = compute_matches(current_user, all_users)
+    matches = load_matches(current_user)
     
     has_matches = len(matches) > 0
     apply_styles(has_matches=has_matches)
@@ -748,9 +724,10 @@ if st.session_state.logged_in and st.session_state.current_user:
         st.session_state.logged_in = False
         st.session_state.current_user = None
         st.session_state.active_chat = None
-        st.session_state.all_users_cache = None
         st.session_state.computed_matches_cache = {}
         st.session_state.chat_messages_cache = {}
+        st.session_state.chat_windows = {}
+        st.session_state.message_times = {}
         st.session_state.unread_counts_cache = {}
         st.rerun()
     
@@ -764,136 +741,10 @@ if st.session_state.logged_in and st.session_state.current_user:
         """, unsafe_allow_html=True)
     else:
         if st.session_state.active_chat is None:
-            st.markdown(f"""
-            <div class="match-header">
-                🎉 Your Top {len(matches)} Match{"es" if len(matches) > 1 else ""}
-            </div>
-            """, unsafe_allow_html=True)
-            
-            for idx, match in enumerate(matches, 1):
-                match_user = match["user"]
-                score = match["score"]
-                
-                chat_id = get_or_create_chat(current_user["id"], match_user["id"])
-                unread = get_unread_count(chat_id, current_user["id"])
-                
-                # Use a container to group the match card and button
-                with st.container():
-                    unread_badge = f"<span class='unread-badge'>{unread} new</span>" if unread > 0 else ""
-                    
-                    st.markdown(f"""
-                    <div class="match-card">
-                        <div style="display:flex;justify-content:space-between;align-items:center;">
-                            <div>
-                                <div style="font-size:1.2rem;font-weight:700;">Match #{idx}: {match_user.get('alias')}</div>
-                                <div class="small-note">Compatibility: {score*100:.1f}%</div>
-                            </div>
-                            <div>{unread_badge}</div>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # Show match message if exists
-                    if match_user.get("match_message"):
-                        st.markdown(f"""
-                        <div style="margin-top:0.8rem;padding:10px;background:rgba(255,255,255,0.03);border-radius:8px;border:1px solid rgba(255,255,255,0.1);font-style:italic;">
-                            "{match_user['match_message']}"
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    # Show Instagram if shared
-                    if match_user.get("share_instagram") and match_user.get("instagram"):
-                        st.markdown(f"""
-                        <div style="margin-top:0.5rem;padding:10px;background:rgba(255,255,255,0.03);border-radius:8px;border:1px solid rgba(255,255,255,0.1);">
-                            📸 Instagram: <a href="https://instagram.com/{match_user['instagram'].replace('@','')}" 
-                               style="color:#00ffe1;text-decoration:none;" target="_blank">
-                               {match_user['instagram']}
-                            </a>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    # Chat button
-                    if st.button(f"💬 Chat with {match_user.get('alias')}", key=f"chat_{match_user['id']}"):
-                        st.session_state.active_chat = {
-                            "chat_id": chat_id,
-                            "match_user": match_user
-                        }
-                        mark_messages_read(chat_id, current_user["id"])
-                        st.rerun()
-                    
-                    # Add spacing between matches
-                    st.markdown("<div style='margin-bottom:1.5rem;'></div>", unsafe_allow_html=True)
-        
+            render_match_list(current_user)
         else:
             # FIXED: Chat interface with proper message alignment
-            active_chat = st.session_state.active_chat
-            chat_id = active_chat["chat_id"]
-            match_user = active_chat["match_user"]
-            
-            st.markdown(f"""
-            <div class="glass">
-                <div style="display:flex;justify-content:space-between;align-items:center;">
-                    <div style="font-size:1.3rem;font-weight:700;">💬 Chat with {match_user.get('alias')}</div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            if st.button("⬅️ Back to Matches"):
-                st.session_state.active_chat = None
-                st.rerun()
-            
-            messages = fetch_messages(chat_id)
-            
-            # FIXED: Chat messages container with proper scrolling and padding
-            st.markdown('<div class="glass" style="min-height:400px;max-height:500px;overflow-y:auto;padding:20px;margin-bottom:1rem;">', unsafe_allow_html=True)
-            
-            if not messages:
-                st.markdown("""
-                <div style="text-align:center;padding:3rem;opacity:0.6;">
-                    <div style="font-size:2rem;margin-bottom:1rem;">💬</div>
-                    <div>No messages yet. Start the conversation!</div>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                # FIXED: Use proper flex container for message alignment
-                st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-                
-                for msg in messages:
-                    is_sent = msg["sender_id"] == current_user["id"]
-                    css_class = "chat-sent" if is_sent else "chat-received"
-                    
-                    ts = msg.get("timestamp")
-                    if ts:
-                        ts_str = ts.strftime("%b %d, %I:%M %p")
-                    else:
-                        ts_str = "Just now"
-                    
-                    # FIXED: Proper message alignment using div with text-align
-                    align_style = "text-align:right;" if is_sent else "text-align:left;"
-                    
-                    st.markdown(f"""
-                    <div style="{align_style}">
-                        <div class="chat-message {css_class}">
-                            <div>{msg['text']}</div>
-                            <div class="chat-timestamp">{ts_str}</div>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                st.markdown('</div>', unsafe_allow_html=True)
-            
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # FIXED: Message input form with cleaner positioning
-            st.markdown('<div style="margin-top:1rem;">', unsafe_allow_html=True)
-            with st.form("message_form", clear_on_submit=True):
-                msg_text = st.text_input("Type a message...", key="msg_input", label_visibility="collapsed")
-                send_btn = st.form_submit_button("📤 Send", use_container_width=True)
-                
-                if send_btn and msg_text.strip():
-                    send_message(chat_id, current_user["id"], msg_text.strip())
-                    st.rerun()
-            st.markdown('</div>', unsafe_allow_html=True)
+            render_chat_panel(current_user)
 
 # ================= NOT LOGGED IN: SHOW COUNTDOWN OR LOGIN/REGISTER =================
 elif not is_unlocked():
@@ -916,6 +767,7 @@ elif not is_unlocked():
             </div>
         </div>
         """, unsafe_allow_html=True)
+        tick_countdown()
     
     st.markdown("""
     <div class="glass" style="text-align:center;">
@@ -1031,10 +883,17 @@ elif not is_unlocked():
                     "match_message": match_message.strip() if match_message else "",
                     "created_at": firestore.SERVER_TIMESTAMP
                 }
+                # Precomputed vector so roster loads skip re-padding the answers
+                user_data["features"] = encode_features(feature_vector(user_data))
+                user_data["features_version"] = FEATURE_ENCODING_VERSION
                 
-                db.collection("users").add(user_data)
+                user_ref = get_db().collection("users").document()
+                batch = get_db().batch()
+                batch.set(user_ref, user_data)
+                bump_roster_version(batch, get_db())
+                batch.commit()
                 
-                invalidate_user_cache()
+                add_to_roster(user_ref.id, user_data)
                 
                 st.success("✅ Registration successful!")
                 st.balloons()
@@ -1139,3 +998,9 @@ else:
                             """, unsafe_allow_html=True)
                         else:
                             st.error("❌ Failed to send email. Please try again.")
+
+# ================= TIMING =================
+# Full-page runs only; fragment reruns record under their own names
+st.session_state.timings["script"] = (time.perf_counter() - SCRIPT_START) * 1000
+if SHOW_TIMINGS:
+    st.caption(" · ".join(f"{name}: {ms:.1f} ms" for name, ms in st.session_state.timings.items()))
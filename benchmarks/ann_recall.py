@@ -0,0 +1,91 @@
+"""Recall@k and latency of the LSH matcher against the exact scorer.
+
+    python -m benchmarks.ann_recall [--users 50000] [--queries 500]
+
+Profiles are synthetic answers drawn from the registration form's ranges.
+Answers are coarse, so many candidates tie on cosine; recall counts an
+approximate match as correct when its score reaches the exact k-th best
+score, which makes it independent of how ties are broken.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from nitematch.ann import AnnConfig
+from nitematch.matching import MatchEngine
+from nitematch.roster import Roster
+
+# Upper bound (inclusive) of each answer, in registration-form order
+PSYCH_RANGES = [10, 10, 10, 10, 10, 1, 1, 10, 1, 1]
+INTEREST_RANGES = [3, 6, 1, 3, 7]
+
+
+def synthetic_users(count, seed):
+    rng = np.random.default_rng(seed)
+    psych = rng.integers(0, np.array(PSYCH_RANGES) + 1, size=(count, len(PSYCH_RANGES)))
+    interest = rng.integers(0, np.array(INTEREST_RANGES) + 1, size=(count, len(INTEREST_RANGES)))
+    genders = rng.choice(["Male", "Female"], size=count)
+    return [
+        {
+            "id": f"u{i}",
+            "gender": str(genders[i]),
+            "answers": {"psych": psych[i].tolist(), "interest": interest[i].tolist()},
+        }
+        for i in range(count)
+    ]
+
+
+def timed_matches(engine, queries):
+    """Run engine.match on every query; returns (results, per-query ms)"""
+    results, latencies = [], []
+    for user in queries:
+        start = time.perf_counter()
+        results.append(engine.match(user))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+
+def recall_at_k(exact, approx):
+    """Tie-aware recall: share of approximate matches scoring at least the exact k-th best"""
+    hits, total = 0, 0
+    for want, got in zip(exact, approx):
+        if not want:
+            continue
+        threshold = want[-1]["score"] - 1e-9
+        hits += min(len(want), sum(m["score"] >= threshold for m in got))
+        total += len(want)
+    return hits / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 3, 4, 8])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    users = synthetic_users(args.users, args.seed)
+    roster = Roster.from_users(users)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [users[i] for i in rng.choice(len(users), size=args.queries, replace=False)]
+
+    exact, exact_ms = timed_matches(MatchEngine(roster), queries)
+    print(f"{args.users} users, {args.queries} queries")
+    print(f"{'scorer':<16}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}{'build s':>10}")
+    print(f"{'exact':<16}{1.0:>10.3f}{np.median(exact_ms):>10.3f}"
+          f"{np.percentile(exact_ms, 95):>10.3f}{0.0:>10.2f}")
+
+    for probes in args.probes:
+        start = time.perf_counter()
+        engine = MatchEngine(roster, ann=AnnConfig(n_probes=probes, exact_below=0))
+        build = time.perf_counter() - start
+
+        approx, approx_ms = timed_matches(engine, queries)
+        print(f"{f'lsh probes={probes}':<16}{recall_at_k(exact, approx):>10.3f}"
+              f"{np.median(approx_ms):>10.3f}{np.percentile(approx_ms, 95):>10.3f}{build:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
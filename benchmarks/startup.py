@@ -0,0 +1,64 @@
+"""Cold-start cost of the app's imports and of building the Firestore client.
+
+    python -m benchmarks.startup [--runs 5] [--client]
+
+Every measurement runs in a fresh interpreter, since a warm process has
+everything cached in sys.modules. "before" is the import set the app had
+with scikit-learn's pairwise cosine; "after" is the current one. --client
+also times init_firestore() (needs .streamlit/secrets.toml). The app now
+pays that cost on first data access instead of on every page, including
+the countdown page.
+"""
+import argparse
+import subprocess
+import sys
+
+import numpy as np
+
+BEFORE = ["streamlit", "firebase_admin.firestore", "numpy", "sklearn.metrics.pairwise"]
+AFTER = [
+    "streamlit", "firebase_admin.firestore", "numpy",
+    "nitematch.chat", "nitematch.buckets", "nitematch.match_cards", "nitematch.mailer",
+    "nitematch.matching", "nitematch.roster", "nitematch.match_store",
+]
+
+TIMER = """
+import time
+start = time.perf_counter()
+{body}
+print(time.perf_counter() - start)
+"""
+
+
+def fresh_seconds(body, runs):
+    """Per-run wall time of `body` in a new interpreter"""
+    code = TIMER.format(body=body)
+    return np.array([
+        float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+        for _ in range(runs)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--client", action="store_true", help="also time init_firestore()")
+    args = parser.parse_args()
+
+    cases = [
+        ("imports before", "\n".join(f"import {m}" for m in BEFORE)),
+        ("imports after", "\n".join(f"import {m}" for m in AFTER)),
+        ("sklearn cosine", "import sklearn.metrics.pairwise"),
+        ("nitematch scorer", "import nitematch.matching"),
+    ]
+    if args.client:
+        cases.append(("firestore client", "from nitematch.firebase import init_firestore\ninit_firestore()"))
+
+    print(f"{'case':<20}{'median s':>10}{'min s':>10}")
+    for name, body in cases:
+        seconds = fresh_seconds(body, args.runs)
+        print(f"{name:<20}{np.median(seconds):>10.3f}{seconds.min():>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
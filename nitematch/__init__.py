@@ -0,0 +1 @@
+"""Shared NITeMatch building blocks used by the Streamlit app and batch jobs."""
@@ -0,0 +1,57 @@
+"""One-off migration: store the binary feature vector on existing users.
+
+    python -m nitematch.backfill_features [--dry-run]
+
+Users registered before the `features` field existed (or with an older
+FEATURE_ENCODING_VERSION) get it written through a BulkWriter. Profiles
+whose answers can't be scored are left alone. Safe to re-run.
+"""
+import sys
+import time
+
+from nitematch.firebase import init_firestore
+from nitematch.matching import (
+    FEATURE_ENCODING_VERSION, decode_features, encode_features, feature_vector
+)
+
+FIELDS = ["answers", "features", "features_version"]
+
+
+def backfill_features(db, dry_run=False):
+    """Write missing or stale feature vectors; returns (scanned, updated)"""
+    scanned = updated = 0
+    writer = None if dry_run else db.bulk_writer()
+
+    for doc in db.collection("users").select(FIELDS).stream():
+        scanned += 1
+        user = doc.to_dict()
+        if decode_features(user) is not None:
+            continue
+
+        vec = feature_vector(user)
+        if vec is None:
+            continue
+
+        updated += 1
+        if writer is not None:
+            writer.update(doc.reference, {
+                "features": encode_features(vec),
+                "features_version": FEATURE_ENCODING_VERSION
+            })
+
+    if writer is not None:
+        writer.close()
+    return scanned, updated
+
+
+def main():
+    dry_run = "--dry-run" in sys.argv[1:]
+    db = init_firestore()
+    start = time.perf_counter()
+    scanned, updated = backfill_features(db, dry_run=dry_run)
+    action = "Would update" if dry_run else "Updated"
+    print(f"{action} {updated} of {scanned} users in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
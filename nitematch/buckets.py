@@ -0,0 +1,179 @@
+"""Bucketed chat message storage.
+
+With `[chat] storage = "buckets"` a new chat keeps its messages inside
+`chats/{chat_id}/buckets/{seq}` documents. Each bucket holds up to
+`bucket_size` messages in a `messages` array, and rolls over early once its
+estimated size reaches MAX_BUCKET_BYTES, well under Firestore's 1 MiB
+document limit. The newest bucket is the hot write target, and its seq,
+fill level and estimated size live on the chat document, so opening a
+300-message chat reads a few documents instead of 300.
+
+SERVER_TIMESTAMP can't be used inside arrays, so a message's timestamp is
+the sender's clock. The append transaction bumps it past the chat's
+previous message, which keeps timestamps strictly increasing per chat and
+lets tail queries keep using `timestamp > since`.
+
+Chats written before buckets existed keep the `messages` subcollection
+until `python -m nitematch.compact_chats` moves them over; the chat
+document's `layout` field says which one a chat uses.
+"""
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+from nitematch.chat import PAGE_SIZE, chat_ref, messages_ref, other_participant
+
+LAYOUT = "buckets"
+DEFAULT_BUCKET_SIZE = 100
+MAX_BUCKET_BYTES = 512 * 1024
+# Field names, the timestamp and array bookkeeping of one message
+MESSAGE_OVERHEAD_BYTES = 64
+TICK = timedelta(microseconds=1)
+
+
+def buckets_ref(db, chat_id):
+    """The chat's `buckets` subcollection"""
+    return chat_ref(db, chat_id).collection("buckets")
+
+
+def bucket_document(seq, messages):
+    return {"seq": seq, "messages": messages, "last_at": messages[-1]["timestamp"]}
+
+
+def message_bytes(message):
+    """Upper estimate of a message's size inside a bucket document"""
+    strings = (message["id"], message["sender_id"], message["text"])
+    return MESSAGE_OVERHEAD_BYTES + sum(len(s.encode()) + 1 for s in strings)
+
+
+def pack(messages, bucket_size=DEFAULT_BUCKET_SIZE, max_bytes=MAX_BUCKET_BYTES):
+    """Split messages, in order, into bucket-sized chunks by count and estimated size"""
+    chunks, chunk, used = [], [], 0
+    for message in messages:
+        size = message_bytes(message)
+        if chunk and (len(chunk) >= bucket_size or used + size > max_bytes):
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append(message)
+        used += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def bucket_messages(doc, since=None):
+    """A bucket's messages, oldest first, optionally only those after `since`"""
+    messages = (doc.to_dict() or {}).get("messages", [])
+    if since is not None:
+        messages = [m for m in messages if m["timestamp"] > since]
+    return messages
+
+
+def newer_query(db, chat_id, since):
+    """Buckets holding at least one message after `since`"""
+    return buckets_ref(db, chat_id).where("last_at", ">", since)
+
+
+def fetch_page(db, chat_id, before=None, page_size=PAGE_SIZE, bucket_size=DEFAULT_BUCKET_SIZE):
+    """
+    Whole buckets, newest first, until at least `page_size` messages; `before`
+    is the lowest bucket seq already loaded. Returns (messages oldest first,
+    cursor for the next older page, has_more), like chat.fetch_page.
+    """
+    query = buckets_ref(db, chat_id)
+    if before is not None:
+        query = query.where("seq", "<", before)
+    # The hot bucket may be nearly empty, hence the extra one
+    limit = -(-page_size // bucket_size) + 1
+    docs = list(query.order_by("seq", direction=firestore.Query.DESCENDING).limit(limit).stream())
+
+    messages = []
+    for doc in reversed(docs):
+        messages.extend(bucket_messages(doc))
+    cursor = docs[-1].get("seq") if docs else before
+    return messages, cursor, len(docs) == limit
+
+
+def fetch_newer(db, chat_id, since):
+    """Messages with a timestamp after `since`, oldest first"""
+    messages = []
+    for doc in newer_query(db, chat_id, since).stream():
+        messages.extend(bucket_messages(doc, since))
+    return sorted(messages, key=lambda m: m["timestamp"])
+
+
+def is_bucketed(db, chat_id):
+    """True for bucketed chats and for chats whose first message is still to come"""
+    snap = chat_ref(db, chat_id).get(field_paths=["layout"])
+    return not snap.exists or (snap.to_dict() or {}).get("layout") == LAYOUT
+
+
+@firestore.transactional
+def _append(transaction, db, chat_id, message, bucket_size):
+    ref = chat_ref(db, chat_id)
+    snap = ref.get(transaction=transaction)
+    state = (snap.to_dict() or {}) if snap.exists else {}
+    metadata = {
+        "participants": chat_id.split("_"),
+        "last_message_at": firestore.SERVER_TIMESTAMP,
+        "unread": {other_participant(chat_id, message["sender_id"]): firestore.Increment(1)}
+    }
+    if not snap.exists:
+        metadata["created_at"] = firestore.SERVER_TIMESTAMP
+
+    if snap.exists and state.get("layout") != LAYOUT:
+        # Not compacted yet: keep writing to the messages subcollection
+        transaction.set(messages_ref(db, chat_id).document(message["id"]), {
+            "sender_id": message["sender_id"],
+            "text": message["text"],
+            "timestamp": firestore.SERVER_TIMESTAMP
+        })
+        transaction.set(ref, metadata, merge=True)
+        return message
+
+    last_at = state.get("bucket_last_at")
+    if last_at is not None and message["timestamp"] <= last_at:
+        message["timestamp"] = last_at + TICK
+
+    seq = state.get("bucket_seq", 0)
+    fill = state.get("bucket_fill", 0)
+    used = state.get("bucket_bytes")
+    size = message_bytes(message)
+    # Chats bucketed before sizes were tracked start a fresh bucket too
+    if fill and (fill >= bucket_size or used is None or used + size > MAX_BUCKET_BYTES):
+        seq, fill, used = seq + 1, 0, 0
+
+    bucket = buckets_ref(db, chat_id).document(str(seq))
+    if fill == 0:
+        transaction.set(bucket, bucket_document(seq, [message]))
+    else:
+        transaction.update(bucket, {
+            "messages": firestore.ArrayUnion([message]),
+            "last_at": message["timestamp"]
+        })
+
+    metadata.update({
+        "layout": LAYOUT,
+        "bucket_seq": seq,
+        "bucket_fill": fill + 1,
+        "bucket_bytes": (used or 0) + size,
+        "bucket_last_at": message["timestamp"]
+    })
+    transaction.set(ref, metadata, merge=True)
+    return message
+
+
+def send_message(db, chat_id, sender_id, text, bucket_size=DEFAULT_BUCKET_SIZE):
+    """
+    Append one message to the chat's hot bucket, starting a new bucket when it
+    is full by count or size, and update the chat metadata in the same
+    transaction.
+    Returns the stored message.
+    """
+    message = {
+        "id": buckets_ref(db, chat_id).document().id,
+        "sender_id": sender_id,
+        "text": text,
+        "timestamp": datetime.now(timezone.utc)
+    }
+    return _append(db.transaction(), db, chat_id, message, bucket_size)
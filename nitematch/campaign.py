@@ -0,0 +1,163 @@
+"""Bulk "your matches are live" emails with a fresh login link per user.
+
+    python -m nitematch.campaign --emails roster.txt [--rate 5] [--connections 4]
+                                 [--checkpoint campaign.jsonl] [--dry-run]
+
+User documents store only `email_hash`, so the addresses come from an
+operator-supplied file with one address per line, such as the campus
+mailing list. Each address is hashed the way registration does, and only
+addresses matching a registered user are mailed.
+
+Users are streamed in chunks. Each chunk's magic-link tokens go out
+through a BulkWriter and are flushed before any of that chunk's emails
+are queued. Emails are sent over `--connections` pooled SMTP connections,
+capped at `--rate` messages per second overall. Every outcome is appended
+to the checkpoint file, and a re-run skips users already sent to, so an
+interrupted campaign resumes where it stopped. Failed users are retried.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import streamlit as st
+
+from nitematch.firebase import init_firestore
+from nitematch.magic_links import hash_email, link_document, link_url, new_token
+from nitematch.mailer import EmailWorker, SmtpPool, render_magic_link
+
+SUBJECT = "💘 Your NITeMatch matches are live"
+CHUNK_SIZE = 500
+DEFAULT_RATE = 5.0
+DEFAULT_CONNECTIONS = 4
+DEFAULT_CHECKPOINT = "campaign-checkpoint.jsonl"
+
+
+def load_emails(path):
+    """{email_hash: address} for every address in the file"""
+    with open(path) as f:
+        addresses = [line.strip() for line in f if line.strip()]
+    return {hash_email(address): address for address in addresses}
+
+
+def load_checkpoint(path):
+    """User ids already sent to by earlier runs"""
+    sent = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["status"] == "sent":
+                    sent.add(entry["user_id"])
+    return sent
+
+
+class Checkpoint:
+    """Append-only outcome log, written from the email worker threads"""
+
+    def __init__(self, path):
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+        self.sent = self.failed = 0
+
+    def record(self, user_id, ok):
+        with self._lock:
+            self._file.write(json.dumps({"user_id": user_id, "status": "sent" if ok else "failed"}) + "\n")
+            self._file.flush()
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    def close(self):
+        self._file.close()
+
+
+def recipients(db, emails, done):
+    """(user_id, email_hash, address) for registered users not yet sent to"""
+    for doc in db.collection("users").select(["email_hash"]).stream():
+        email_hash = doc.get("email_hash")
+        if doc.id not in done and email_hash in emails:
+            yield doc.id, email_hash, emails[email_hash]
+
+
+def chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def report(checkpoint, queued, start):
+    elapsed = time.perf_counter() - start
+    rate = checkpoint.sent / elapsed if elapsed else 0.0
+    print(f"sent {checkpoint.sent}, failed {checkpoint.failed}, queued {queued} "
+          f"({rate:.1f}/s, {elapsed:.0f}s)", flush=True)
+
+
+def run_campaign(db, worker, checkpoint, emails, done, base_url):
+    """Issue tokens and queue emails chunk by chunk; returns the number queued"""
+    queued = 0
+    start = time.perf_counter()
+
+    for chunk in chunks(recipients(db, emails, done), CHUNK_SIZE):
+        writer = db.bulk_writer()
+        tokens = []
+        for user_id, email_hash, address in chunk:
+            token = new_token()
+            writer.set(db.collection("magic_links").document(token), link_document(email_hash, address))
+            tokens.append(token)
+        # Links must resolve before anyone can click them
+        writer.close()
+
+        for (user_id, _, address), token in zip(chunk, tokens):
+            html = render_magic_link(link_url(base_url, token))
+            worker.enqueue(address, SUBJECT, html, block=True,
+                           on_done=lambda ok, user_id=user_id: checkpoint.record(user_id, ok))
+            queued += 1
+        report(checkpoint, queued, start)
+
+    worker.join()
+    report(checkpoint, queued, start)
+    return queued
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emails", required=True, help="file with one address per line")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="messages per second ceiling")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    db = init_firestore()
+    emails = load_emails(args.emails)
+    done = load_checkpoint(args.checkpoint)
+
+    if args.dry_run:
+        pending = sum(1 for _ in recipients(db, emails, done))
+        print(f"Would email {pending} users ({len(done)} already sent)")
+        return
+
+    smtp = st.secrets["smtp"]
+    pool = SmtpPool(smtp.get("server", "smtp.gmail.com"), smtp.get("port", 587),
+                    smtp["email"], smtp["password"], size=args.connections)
+    worker = EmailWorker(pool, smtp["email"], queue_size=CHUNK_SIZE, workers=args.connections,
+                         max_per_second=args.rate)
+    checkpoint = Checkpoint(args.checkpoint)
+    try:
+        base_url = st.secrets.get("app", {}).get("base_url", "https://nitematch.streamlit.app")
+        run_campaign(db, worker, checkpoint, emails, done, base_url)
+    finally:
+        checkpoint.close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Firestore access for chat messages.
+
+History is read in pages: the newest PAGE_SIZE messages first, older pages
+on demand through a `start_after` cursor, and an incremental tail query for
+anything newer than the last cached message. A long conversation costs a
+handful of reads per refresh instead of re-streaming every message.
+
+In real-time mode a ChatFeed keeps an `on_snapshot` listener on the active
+chat's new messages; Firestore pushes deltas into a locked buffer on its
+watch thread and the chat panel drains it on a short periodic refresh.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.watch import ChangeType
+
+PAGE_SIZE = 30
+MAX_MESSAGE_CHARS = 1000
+FEED_IDLE_SECONDS = 60
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def chat_ref(db, chat_id):
+    return db.collection("chats").document(chat_id)
+
+
+def messages_ref(db, chat_id):
+    """The chat's `messages` subcollection"""
+    return chat_ref(db, chat_id).collection("messages")
+
+
+def chat_id_for(user1_id, user2_id):
+    """Chat ids are the two sorted user ids joined with "_" """
+    return "_".join(sorted([user1_id, user2_id]))
+
+
+def other_participant(chat_id, user_id):
+    first, second = chat_id.split("_")
+    return second if first == user_id else first
+
+
+def message_batch(db, chat_id, sender_id, text, new_chat=False):
+    """
+    The message (under a client-generated id) and the chat's metadata as one
+    atomic batch; the merge creates the chat document on the first message.
+    Returns (batch, message_ref).
+    """
+    message_ref = messages_ref(db, chat_id).document()
+    recipient_id = other_participant(chat_id, sender_id)
+    metadata = {
+        "participants": chat_id.split("_"),
+        "last_message_at": firestore.SERVER_TIMESTAMP,
+        # Per-participant unread counter, so the match list never scans messages
+        "unread": {recipient_id: firestore.Increment(1)}
+    }
+    if new_chat:
+        metadata["created_at"] = firestore.SERVER_TIMESTAMP
+
+    batch = db.batch()
+    batch.set(message_ref, {
+        "sender_id": sender_id,
+        "text": text,
+        "timestamp": firestore.SERVER_TIMESTAMP
+    })
+    batch.set(chat_ref(db, chat_id), metadata, merge=True)
+    return batch, message_ref
+
+
+def merge_messages(messages, incoming):
+    """
+    Upsert `incoming` into the time-ordered `messages` list by id; server
+    copies replace locally appended pending ones.
+    """
+    positions = {m["id"]: i for i, m in enumerate(messages)}
+    for message in incoming:
+        if message["id"] in positions:
+            messages[positions[message["id"]]] = message
+        else:
+            messages.append(message)
+    if incoming:
+        messages.sort(key=lambda m: m["timestamp"])
+
+
+def chat_states(db, chat_ids, user_id, timeout=None):
+    """
+    {chat_id: {"unread", "last_read_at"}} for user_id from the chat documents
+    in one batched read. Chats nobody has written to yet are left out; chats
+    created before the counters existed have "unread" None.
+    """
+    refs = [chat_ref(db, chat_id) for chat_id in chat_ids]
+    states = {}
+    for snap in db.get_all(refs, field_paths=["unread", "last_read_at"], timeout=timeout):
+        if not snap.exists:
+            continue
+        data = snap.to_dict() or {}
+        unread = data.get("unread")
+        states[snap.id] = {
+            "unread": None if unread is None else unread.get(user_id, 0),
+            "last_read_at": data.get("last_read_at", {}).get(user_id)
+        }
+    return states
+
+
+def count_unread(db, chat_id, user_id, last_read_at=None, timeout=None):
+    """Messages from the other participant newer than user_id's read watermark"""
+    query = messages_ref(db, chat_id).where("timestamp", ">", last_read_at or EPOCH)
+    return sum(
+        1 for doc in query.select(["sender_id"]).stream(timeout=timeout)
+        if doc.get("sender_id") != user_id
+    )
+
+
+def _to_message(doc):
+    data = doc.to_dict()
+    data["id"] = doc.id
+    return data
+
+
+def fetch_page(db, chat_id, before=None, page_size=PAGE_SIZE):
+    """
+    One page of history, oldest first, ending just before the `before`
+    cursor (a DocumentSnapshot) or at the newest message.
+    Returns (messages, cursor for the next older page, has_more).
+    """
+    query = messages_ref(db, chat_id).order_by("timestamp", direction=firestore.Query.DESCENDING)
+    if before is not None:
+        query = query.start_after(before)
+
+    # One extra document tells us whether an older page exists
+    docs = list(query.limit(page_size + 1).stream())
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+
+    cursor = docs[-1] if docs else before
+    return [_to_message(doc) for doc in reversed(docs)], cursor, has_more
+
+
+def fetch_newer(db, chat_id, since):
+    """Messages with a timestamp after `since`, oldest first"""
+    query = (
+        messages_ref(db, chat_id)
+        .where("timestamp", ">", since)
+        .order_by("timestamp", direction=firestore.Query.ASCENDING)
+    )
+    return [_to_message(doc) for doc in query.stream()]
+
+
+class ChatFeed:
+    """
+    Listener-backed buffer of one chat's messages newer than `since`.
+    `to_messages(doc, since)` turns a changed document into its messages.
+    """
+
+    def __init__(self, query, to_messages, since):
+        self.since = since
+        self.last_polled = time.monotonic()
+        self._to_messages = to_messages
+        self._lock = threading.Lock()
+        self._messages = {}
+        self._doc_messages = {}
+        self._watch = query.on_snapshot(self._on_snapshot)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # Runs on the watch thread
+        with self._lock:
+            for change in changes:
+                doc = change.document
+                for message_id in self._doc_messages.pop(doc.id, []):
+                    self._messages.pop(message_id, None)
+                if change.type == ChangeType.REMOVED:
+                    continue
+                messages = self._to_messages(doc, self.since)
+                self._doc_messages[doc.id] = [m["id"] for m in messages]
+                self._messages.update((m["id"], m) for m in messages)
+
+    @property
+    def active(self):
+        return self._watch.is_active
+
+    def messages(self):
+        """Buffered messages, oldest first"""
+        self.last_polled = time.monotonic()
+        with self._lock:
+            buffered = list(self._messages.values())
+        return sorted(buffered, key=lambda m: m["timestamp"])
+
+    def close(self):
+        self._watch.unsubscribe()
+
+
+class ChatFeeds:
+    """
+    Process-wide ChatFeed registry; both participants share one listener.
+    Feeds nobody has polled for `idle_seconds` are closed on the next lookup.
+    """
+
+    def __init__(self, db, idle_seconds=FEED_IDLE_SECONDS):
+        self.db = db
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._feeds = {}
+
+    def get(self, chat_id, since=None, bucketed=False):
+        with self._lock:
+            self._close_idle()
+            feed = self._feeds.get(chat_id)
+            if feed is None or not feed.active:
+                feed = self._open(chat_id, since or EPOCH, bucketed)
+                self._feeds[chat_id] = feed
+            return feed
+
+    def _open(self, chat_id, since, bucketed):
+        if bucketed:
+            # Imported here: nitematch.buckets builds on this module
+            from nitematch import buckets
+            return ChatFeed(buckets.newer_query(self.db, chat_id, since), buckets.bucket_messages, since)
+        query = messages_ref(self.db, chat_id).where("timestamp", ">", since)
+        return ChatFeed(query, lambda doc, _: [_to_message(doc)], since)
+
+    def _close_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for chat_id, feed in list(self._feeds.items()):
+            if feed.last_polled < cutoff:
+                feed.close()
+                del self._feeds[chat_id]
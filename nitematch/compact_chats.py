@@ -0,0 +1,131 @@
+"""Background compaction: move `messages` subcollections into buckets.
+
+    python -m nitematch.compact_chats [--bucket-size 100] [--dry-run]
+
+Run it only once every app instance has `[chat] storage = "buckets"`.
+Subcollection-mode instances would keep writing to the old layout.
+
+For each chat, one transaction reads every message and switches the chat
+document to the bucket layout. A send racing the switch is retried by
+Firestore, so from then on every new message lands in a bucket. The old
+messages are copied into buckets with negative seqs, below the new hot
+bucket 0, and then deleted from the subcollection. Chats that predate the
+unread counters get them from the read watermark. Bucketed chats are
+skipped, so the job is safe to re-run. A reader opening a chat while its
+copy is in flight may briefly see a partial history.
+"""
+import argparse
+import time
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from nitematch.buckets import DEFAULT_BUCKET_SIZE, LAYOUT, bucket_document, buckets_ref, pack
+from nitematch.chat import EPOCH, chat_ref, messages_ref
+from nitematch.firebase import init_firestore
+
+
+def unread_from_watermarks(participants, messages, last_read_at):
+    """Per-participant counters for a chat that has none"""
+    return {
+        user_id: sum(
+            1 for m in messages
+            if m["sender_id"] != user_id and m["timestamp"] > last_read_at.get(user_id, EPOCH)
+        )
+        for user_id in participants
+    }
+
+
+@firestore.transactional
+def _switch_layout(transaction, db, chat_id):
+    """Read the chat's messages and point new writes at buckets; None if already bucketed"""
+    ref = chat_ref(db, chat_id)
+    chat = ref.get(transaction=transaction).to_dict() or {}
+    if chat.get("layout") == LAYOUT:
+        return None
+
+    messages = []
+    # Transactions read queries, not collections; document-id order keeps
+    # messages that lack a timestamp, which an order_by("timestamp") would drop
+    for doc in transaction.get(messages_ref(db, chat_id).order_by(FieldPath.document_id())):
+        data = doc.to_dict()
+        messages.append({
+            "id": doc.id,
+            "sender_id": data.get("sender_id"),
+            "text": data.get("text", ""),
+            "timestamp": data.get("timestamp") or chat.get("created_at") or EPOCH
+        })
+    messages.sort(key=lambda m: m["timestamp"])
+
+    switch = {
+        "layout": LAYOUT,
+        "bucket_seq": 0,
+        "bucket_fill": 0,
+        "bucket_bytes": 0,
+        "bucket_last_at": messages[-1]["timestamp"] if messages else None
+    }
+    if "unread" not in chat:
+        participants = chat.get("participants") or chat_id.split("_")
+        switch["unread"] = unread_from_watermarks(participants, messages, chat.get("last_read_at", {}))
+    transaction.set(ref, switch, merge=True)
+    return messages
+
+
+def compact_chat(db, chat_id, writer, bucket_size=DEFAULT_BUCKET_SIZE):
+    """Move one chat into buckets; returns the number of messages moved, or None if skipped"""
+    messages = _switch_layout(db.transaction(), db, chat_id)
+    if messages is None:
+        return None
+
+    chunks = pack(messages, bucket_size)
+    for i, chunk in enumerate(chunks):
+        seq = i - len(chunks)
+        writer.set(buckets_ref(db, chat_id).document(str(seq)), bucket_document(seq, chunk))
+    # Buckets must be durable before the originals go
+    writer.flush()
+    for message in messages:
+        writer.delete(messages_ref(db, chat_id).document(message["id"]))
+    return len(messages)
+
+
+def compact_chats(db, bucket_size=DEFAULT_BUCKET_SIZE, dry_run=False):
+    """Compact every subcollection chat; returns (scanned, compacted, messages moved)"""
+    scanned = compacted = moved = 0
+    writer = None if dry_run else db.bulk_writer()
+
+    for doc in db.collection("chats").select(["layout"]).stream():
+        scanned += 1
+        if (doc.to_dict() or {}).get("layout") == LAYOUT:
+            continue
+
+        if writer is None:
+            compacted += 1
+            moved += sum(1 for _ in messages_ref(db, doc.id).select([]).stream())
+            continue
+
+        count = compact_chat(db, doc.id, writer, bucket_size)
+        if count is not None:
+            compacted += 1
+            moved += count
+
+    if writer is not None:
+        writer.close()
+    return scanned, compacted, moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bucket-size", type=int, default=DEFAULT_BUCKET_SIZE)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    db = init_firestore()
+    start = time.perf_counter()
+    scanned, compacted, moved = compact_chats(db, args.bucket_size, args.dry_run)
+    action = "Would compact" if args.dry_run else "Compacted"
+    print(f"{action} {compacted} of {scanned} chats ({moved} messages) "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Magic-link login tokens.
+
+A token is a random URL-safe string and the id of its `magic_links`
+document, which records who it logs in and when it expires. The app
+issues one per login request; nitematch.campaign issues them in bulk.
+"""
+import hashlib
+import secrets
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+LINK_TTL = timedelta(hours=24)
+
+
+def hash_email(email):
+    """Hash email for privacy"""
+    return hashlib.sha256(email.lower().strip().encode()).hexdigest()
+
+
+def new_token():
+    return secrets.token_urlsafe(32)
+
+
+def link_document(email_hash, email, ttl=LINK_TTL):
+    """Fields of a fresh, unused magic_links document"""
+    return {
+        "email_hash": email_hash,
+        "email": email,
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "expires_at": datetime.now(timezone.utc) + ttl,
+        "used": False
+    }
+
+
+def link_url(base_url, token):
+    return f"{base_url}/?token={token}"
@@ -0,0 +1,270 @@
+"""Background email delivery for magic links.
+
+Sending used to happen inside the Streamlit request: a fresh SMTP
+connection, STARTTLS and login for every link. Now the form handler only
+renders the precompiled template and enqueues the message. A few daemon
+workers drain the bounded queue over pooled, already-authenticated
+connections. Transient failures are retried with exponential backoff on a
+fresh connection. `EmailWorker.stats()` reports throughput, queue depth,
+retries and failures. Bulk senders (nitematch.campaign) add a
+messages-per-second ceiling and a per-email completion callback.
+"""
+import logging
+import queue
+import smtplib
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from string import Template
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_QUEUE_SIZE = 1000
+MAX_ATTEMPTS = 4
+BACKOFF_SECONDS = 1.0
+# Servers drop idle sessions after a few minutes; reconnect before that
+MAX_IDLE_SECONDS = 60
+
+MAGIC_LINK_SUBJECT = "🔐 Your NITeMatch Login Link"
+MAGIC_LINK_TEMPLATE = Template("""\
+<html>
+<body style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; margin: 0; padding: 0; background-color: #0a0118;">
+    <table width="100%" cellpadding="0" cellspacing="0" style="background: linear-gradient(135deg, #0a0118 0%, #1a0520 50%, #0a0118 100%); padding: 40px 20px;">
+        <tr>
+            <td align="center">
+                <table width="600" cellpadding="0" cellspacing="0" style="background: rgba(20,20,40,0.95); border-radius: 24px; overflow: hidden; border: 1px solid rgba(255,255,255,0.1);">
+                    <tr>
+                        <td style="padding: 40px; text-align: center;">
+                            <h1 style="margin: 0 0 10px 0; font-size: 2.5rem; background: linear-gradient(90deg, #ff4fd8, #00ffe1); -webkit-background-clip: text; -webkit-text-fill-color: transparent; background-clip: text;">
+                                💘 NITeMatch
+                            </h1>
+                            <p style="margin: 0 0 30px 0; color: #a0a0a0; font-size: 1rem;">Your matches are waiting!</p>
+
+                            <div style="background: rgba(139,92,246,0.2); border-radius: 16px; padding: 30px; margin: 20px 0;">
+                                <p style="color: white; font-size: 1.1rem; margin: 0 0 20px 0;">
+                                    Click the button below to access your account:
+                                </p>
+                                <a href="$magic_link" style="display: inline-block; background: linear-gradient(135deg, #ff4fd8, #00ffe1); color: white; text-decoration: none; padding: 16px 40px; border-radius: 12px; font-weight: 600; font-size: 1.1rem; margin: 10px 0;">
+                                    🔓 Login to NITeMatch
+                                </a>
+                            </div>
+
+                            <div style="background: rgba(255,255,255,0.05); border-radius: 12px; padding: 20px; margin: 20px 0;">
+                                <p style="color: #a0a0a0; font-size: 0.9rem; margin: 0;">
+                                    🔒 This link expires in 24 hours<br>
+                                    For security, don't share this link with anyone
+                                </p>
+                            </div>
+
+                            <p style="color: #707070; font-size: 0.85rem; margin: 30px 0 0 0; line-height: 1.6;">
+                                If you didn't request this login, you can safely ignore this email.<br>
+                                This is an automated message from NITeMatch.
+                            </p>
+                        </td>
+                    </tr>
+                </table>
+            </td>
+        </tr>
+    </table>
+</body>
+</html>
+""")
+
+
+def render_magic_link(magic_link):
+    return MAGIC_LINK_TEMPLATE.substitute(magic_link=magic_link)
+
+
+class SmtpPool:
+    """Authenticated SMTP connections reused across sends, at most `size` open"""
+
+    def __init__(self, server, port, username, password, size=DEFAULT_POOL_SIZE, timeout=30):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.opened = 0
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            connection.starttls()
+            connection.login(self.username, self.password)
+        except Exception:
+            connection.close()
+            raise
+        with self._lock:
+            self.opened += 1
+        return connection
+
+    def acquire(self):
+        """An authenticated connection; blocks while `size` are in use"""
+        self._slots.acquire()
+        cutoff = time.monotonic() - MAX_IDLE_SECONDS
+        with self._lock:
+            stale = [c for c, used in self._idle if used < cutoff]
+            self._idle = [(c, used) for c, used in self._idle if used >= cutoff]
+            connection = self._idle.pop()[0] if self._idle else None
+        for old in stale:
+            _close_quietly(old)
+
+        if connection is None:
+            try:
+                connection = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+        return connection
+
+    def release(self, connection, broken=False):
+        if broken:
+            _close_quietly(connection)
+        else:
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            _close_quietly(connection)
+
+
+def _close_quietly(connection):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
+
+
+class RateLimiter:
+    """Spaces calls at least 1/per_second apart across all threads"""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class EmailWorker:
+    """Bounded queue of outgoing HTML emails drained by daemon threads"""
+
+    def __init__(self, pool, sender, queue_size=DEFAULT_QUEUE_SIZE, workers=DEFAULT_POOL_SIZE,
+                 max_attempts=MAX_ATTEMPTS, backoff_seconds=BACKOFF_SECONDS, max_per_second=None):
+        self.pool = pool
+        self.sender = sender
+        self.limiter = RateLimiter(max_per_second) if max_per_second else None
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "send_seconds": 0.0,
+        }
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f"email-worker-{i}", daemon=True).start()
+
+    def enqueue(self, recipient, subject, html, block=False, on_done=None):
+        """
+        Queue one email; False when the queue is full. With block=True wait
+        for room instead. `on_done(ok)` is called from the worker thread.
+        """
+        try:
+            self._queue.put((recipient, subject, html, on_done), block=block)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def stats(self):
+        """Counters plus queue depth, open connections and throughput"""
+        with self._lock:
+            stats = dict(self._stats)
+        elapsed = time.monotonic() - self._started_at
+        stats.update(
+            queued=self._queue.qsize(),
+            connections_opened=self.pool.opened,
+            sent_per_minute=stats["sent"] * 60 / elapsed if elapsed else 0.0,
+            avg_send_ms=stats["send_seconds"] * 1000 / stats["sent"] if stats["sent"] else 0.0,
+        )
+        return stats
+
+    def join(self):
+        """Block until every queued email was sent or given up on"""
+        self._queue.join()
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _message(self, recipient, subject, html):
+        msg = MIMEMultipart("alternative")
+        msg["Subject"] = subject
+        msg["From"] = self.sender
+        msg["To"] = recipient
+        msg.attach(MIMEText(html, "html"))
+        return msg
+
+    def _run(self):
+        while True:
+            recipient, subject, html, on_done = self._queue.get()
+            try:
+                ok = self._deliver(recipient, subject, html)
+                if on_done is not None:
+                    on_done(ok)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, recipient, subject, html):
+        """Send with retries; True once delivered"""
+        msg = self._message(recipient, subject, html)
+        for attempt in range(1, self.max_attempts + 1):
+            connection = None
+            if self.limiter is not None:
+                self.limiter.wait()
+            try:
+                connection = self.pool.acquire()
+                start = time.perf_counter()
+                connection.send_message(msg)
+            except smtplib.SMTPRecipientsRefused:
+                # Permanent: retrying the same address won't help
+                self.pool.release(connection)
+                self._count("failed")
+                logger.warning("Recipient refused: %s", recipient)
+                return False
+            except (smtplib.SMTPException, OSError) as e:
+                if connection is not None:
+                    self.pool.release(connection, broken=True)
+                if attempt == self.max_attempts:
+                    self._count("failed")
+                    logger.warning("Giving up on email to %s after %d attempts: %s", recipient, attempt, e)
+                    return False
+                self._count("retries")
+                time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+            else:
+                self.pool.release(connection)
+                self._count("sent")
+                self._count("send_seconds", time.perf_counter() - start)
+                return True
@@ -0,0 +1,94 @@
+"""View model for the match list, loaded with a concurrent fan-out.
+
+A card needs the match's display fields, whether a chat exists, and the
+viewer's unread count. Display fields and chat states are two independent
+batched reads, so they run side by side on a bounded thread pool. Chats
+that predate the unread counters then get their message counts
+concurrently as well. Every RPC has a timeout, and the whole load shares
+one deadline. A slow or failed call degrades its part of the card instead
+of stalling the page: placeholder display fields, or an unknown unread
+count that is retried on the next render.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from google.api_core.exceptions import GoogleAPICallError
+
+from nitematch import chat
+
+MAX_WORKERS = 8
+DEFAULT_TIMEOUT_SECONDS = 3.0
+PLACEHOLDER_ALIAS = "Your match"
+
+
+def make_executor(max_workers=MAX_WORKERS):
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="match-cards")
+
+
+def _result(future, deadline, default):
+    """The future's value, or `default` if it failed or missed the deadline"""
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except (FutureTimeoutError, GoogleAPICallError):
+        future.cancel()
+        return default
+
+
+def load_match_cards(db, display, executor, user_id, matches, cached_unread=None,
+                     timeout=DEFAULT_TIMEOUT_SECONDS):
+    """
+    {"user", "score", "chat_id", "chat_exists", "unread"} cards for
+    [{"id", "score"}] matches, in match order; users deleted since matching
+    are left out. `cached_unread`
+    maps chat ids to counts the caller already holds; those chats are not
+    re-read. "chat_exists" and "unread" are None when their read failed.
+    """
+    cached_unread = cached_unread or {}
+    deadline = time.monotonic() + timeout
+    user_ids = [m["id"] for m in matches]
+    chat_ids = {uid: chat.chat_id_for(user_id, uid) for uid in user_ids}
+    missing = [c for c in chat_ids.values() if c not in cached_unread]
+
+    display_future = executor.submit(display.get_many, user_ids, timeout)
+    states_future = executor.submit(chat.chat_states, db, missing, user_id, timeout) if missing else None
+
+    states = _result(states_future, deadline, None) if states_future else {}
+    # Chats without counters: count their messages against the read watermark
+    legacy = {
+        chat_id: executor.submit(chat.count_unread, db, chat_id, user_id, state["last_read_at"], timeout)
+        for chat_id, state in (states or {}).items()
+        if state["unread"] is None
+    }
+    users = _result(display_future, deadline, None)
+
+    cards = []
+    for uid, match in zip(user_ids, matches):
+        if users is None:
+            user = {"id": uid, "alias": PLACEHOLDER_ALIAS}
+        elif uid in users:
+            user = users[uid]
+        else:
+            # Deleted since matching
+            continue
+
+        chat_id = chat_ids[uid]
+        if chat_id in cached_unread:
+            exists, unread = True, cached_unread[chat_id]
+        elif states is None:
+            exists, unread = None, None
+        elif chat_id not in states:
+            exists, unread = False, 0
+        elif chat_id in legacy:
+            exists, unread = True, _result(legacy[chat_id], deadline, None)
+        else:
+            exists, unread = True, states[chat_id]["unread"]
+
+        cards.append({
+            "user": user,
+            "score": match["score"],
+            "chat_id": chat_id,
+            "chat_exists": exists,
+            "unread": unread
+        })
+    return cards
@@ -0,0 +1,71 @@
+"""Precomputed match documents and the roster version that guards them.
+
+Each user gets one compact `matches/{user_id}` document holding the ids and
+scores of their top matches. `meta/roster.version` is bumped on every
+registration; a match document stamped with an older version is stale and
+gets recomputed on the next login.
+"""
+from firebase_admin import firestore
+
+MATCHES_COLLECTION = "matches"
+META_COLLECTION = "meta"
+ROSTER_DOC = "roster"
+
+
+def roster_meta_ref(db):
+    """Reference to the roster metadata document"""
+    return db.collection(META_COLLECTION).document(ROSTER_DOC)
+
+
+def get_roster_version(db):
+    """Current roster version (0 before the first registration)"""
+    doc = roster_meta_ref(db).get()
+    if not doc.exists:
+        return 0
+    return doc.to_dict().get("version", 0)
+
+
+def bump_roster_version(batch, db):
+    """Queue a roster version increment on a write batch"""
+    batch.set(roster_meta_ref(db), {
+        "version": firestore.Increment(1),
+        "updated_at": firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+
+def match_document(matches, roster_version):
+    """Compact match document: parallel id/score lists plus the roster version"""
+    return {
+        "match_ids": [m["id"] for m in matches],
+        "scores": [float(m["score"]) for m in matches],
+        "roster_version": roster_version,
+        "computed_at": firestore.SERVER_TIMESTAMP
+    }
+
+
+def save_matches(db, user_id, matches, roster_version):
+    """Store one user's matches"""
+    db.collection(MATCHES_COLLECTION).document(user_id).set(
+        match_document(matches, roster_version)
+    )
+
+
+def load_match_document(db, user_id):
+    """Fetch one user's match document, or None if it was never computed"""
+    doc = db.collection(MATCHES_COLLECTION).document(user_id).get()
+    if not doc.exists:
+        return None
+    return doc.to_dict()
+
+
+def is_stale(match_doc, roster_version):
+    """Check whether a match document predates the current roster"""
+    return match_doc is None or match_doc.get("roster_version", -1) < roster_version
+
+
+def matches_from_document(match_doc):
+    """Turn a match document back into the engine's [{"id": ..., "score": ...}] shape"""
+    return [
+        {"id": uid, "score": score}
+        for uid, score in zip(match_doc.get("match_ids", []), match_doc.get("scores", []))
+    ]
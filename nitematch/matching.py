@@ -0,0 +1,374 @@
+"""Vectorized compatibility scoring.
+
+Every profile becomes a 15-dimension psych+interest vector. Scorable
+profiles are kept pre-partitioned by gender, each partition holding a
+float32 feature matrix with precomputed inverse row norms. Cosine similarity
+for a user (or a batch of users) is a single matrix product against the
+opposite-gender partition, with no per-request filtering.
+
+Answers are small integers, so the float32 dot products are exact and the
+cosine only rounds once when the norms are applied. That keeps scores
+bit-identical between the matrix-vector and matrix-matrix paths, and ties
+break by roster order exactly like the old stable sort.
+"""
+import numpy as np
+
+from nitematch.ann import LSHIndex
+
+PSYCH_LENGTH = 10
+INTEREST_LENGTH = 5
+PSYCH_FILL = 3  # Middle value for unanswered sliders
+INTEREST_FILL = 0
+FEATURE_DIM = PSYCH_LENGTH + INTEREST_LENGTH
+
+# Rows scored per matrix-matrix product in match_rows, bounds peak memory
+BATCH_ROWS = 1024
+
+# Gender codes stored in the columnar roster
+MALE = 0
+FEMALE = 1
+UNKNOWN_GENDER = -1
+GENDER_CODES = {"Male": MALE, "Female": FEMALE}
+
+# Binary `features` field on user documents: FEATURE_DIM little-endian float32
+# values of the padded answer vector. Bump the version when the layout or the
+# padding rules change; stale encodings fall back to the raw answers.
+FEATURE_ENCODING_VERSION = 1
+FEATURE_DTYPE = np.dtype("<f4")
+
+
+def pad_to_length(arr, target_length, fill_value=0):
+    """
+    CRITICAL FIX: Pad or truncate array to target length.
+    This prevents dimension mismatch errors.
+    """
+    arr = list(arr)
+    if len(arr) < target_length:
+        arr.extend([fill_value] * (target_length - len(arr)))
+    elif len(arr) > target_length:
+        arr = arr[:target_length]
+    return arr
+
+
+def has_answers(user):
+    """Check that a profile carries both answer groups"""
+    answers = user.get("answers")
+    return isinstance(answers, dict) and "psych" in answers and "interest" in answers
+
+
+def encode_features(vec):
+    """Pack a feature vector into the bytes stored on the user document"""
+    return np.asarray(vec, dtype=FEATURE_DTYPE).tobytes()
+
+
+def decode_features(user):
+    """Zero-copy view of a stored feature vector, or None if absent or stale"""
+    data = user.get("features")
+    if user.get("features_version") != FEATURE_ENCODING_VERSION or not isinstance(data, bytes):
+        return None
+    if len(data) != FEATURE_DIM * FEATURE_DTYPE.itemsize:
+        return None
+    return np.frombuffer(data, dtype=FEATURE_DTYPE)
+
+
+def feature_vector(user):
+    """
+    The psych+interest vector, or None if the profile can't be scored.
+    Uses the stored binary encoding when present, else pads the raw answers.
+    """
+    stored = decode_features(user)
+    if stored is not None:
+        return stored
+
+    if not has_answers(user):
+        return None
+
+    psych = pad_to_length(user["answers"].get("psych", []), PSYCH_LENGTH, PSYCH_FILL)
+    interest = pad_to_length(user["answers"].get("interest", []), INTEREST_LENGTH, INTEREST_FILL)
+
+    try:
+        return np.asarray(psych + interest, dtype=np.float32)
+    except (TypeError, ValueError):
+        # Malformed answers are skipped, same as the old per-candidate loop
+        return None
+
+
+def inverse_norms(matrix):
+    """1/L2 norm per row; all-zero rows get 0 so their cosine is 0"""
+    norms = np.linalg.norm(np.asarray(matrix, dtype=np.float64), axis=-1)
+    return np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+
+
+def gender_code(gender):
+    """Compact int8 code for a gender string"""
+    return GENDER_CODES.get(gender, UNKNOWN_GENDER)
+
+
+def opposite_gender(code):
+    """Gender code of the candidate pool for a user"""
+    return FEMALE if code == MALE else MALE
+
+
+def match_limit(code):
+    """Number of matches shown: Male=3, Female=5"""
+    return 3 if code == MALE else 5
+
+
+def top_k_indices(scores, k):
+    """
+    Indices of the k best scores, best first.
+    Ties keep roster order, matching the old stable sort over candidates.
+    """
+    valid = int(np.count_nonzero(np.isfinite(scores)))
+    k = min(k, valid)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+        kth = scores[part].min()
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        idx = np.concatenate([above, ties])
+    else:
+        idx = np.flatnonzero(np.isfinite(scores))
+
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+
+class Partition:
+    """
+    One gender's scorable profiles: roster rows, float32 features and
+    inverse norms, plus a user id -> position index.
+
+    The features of the roster's base rows are a slice of the roster matrix,
+    not a copy, so a memory-mapped snapshot stays shared between processes
+    through the page cache. Rosters are gender-sorted, which keeps each
+    partition's rows contiguous; an unsorted one falls back to a copy. Rows
+    appended later go into a side buffer that grows geometrically, so
+    registrations append in amortized O(1).
+    """
+
+    def __init__(self, features=None, rows=(), ids=()):
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            base = np.empty((0, FEATURE_DIM), dtype=np.float32)
+        elif rows[-1] - rows[0] + 1 == len(rows):
+            base = features[rows[0]:rows[-1] + 1]
+        else:
+            base = np.asarray(features[rows])
+
+        self.base = base
+        self.size = len(rows)
+        self.index = {user_id: position for position, user_id in enumerate(ids)}
+        self._rows = rows.copy()
+        self._inv_norms = inverse_norms(base)
+        self._extra = np.empty((0, FEATURE_DIM), dtype=np.float32)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def rows(self):
+        return self._rows[:self.size]
+
+    @property
+    def extra(self):
+        """Features of the rows appended after the base"""
+        return self._extra[:self.size - len(self.base)]
+
+    @property
+    def inv_norms(self):
+        return self._inv_norms[:self.size]
+
+    def append(self, rows, ids, features):
+        """Add roster rows with their user ids and raw feature vectors"""
+        count = len(rows)
+        if count == 0:
+            return
+
+        needed = self.size + count
+        if needed > len(self._rows):
+            capacity = max(needed, 2 * len(self._rows), 64)
+            self._rows = np.resize(self._rows, capacity)
+            self._inv_norms = np.resize(self._inv_norms, capacity)
+
+        start = self.size - len(self.base)
+        if start + count > len(self._extra):
+            capacity = max(start + count, 2 * len(self._extra), 64)
+            extra = np.zeros((capacity, FEATURE_DIM), dtype=np.float32)
+            extra[:start] = self.extra
+            self._extra = extra
+
+        self._rows[self.size:needed] = rows
+        self._extra[start:start + count] = features
+        self._inv_norms[self.size:needed] = inverse_norms(features)
+        for offset, user_id in enumerate(ids):
+            self.index[user_id] = self.size + offset
+        self.size = needed
+
+    def vectors(self, positions):
+        """Raw feature vectors at these partition positions"""
+        positions = np.asarray(positions, dtype=np.int64)
+        size = len(self.base)
+        if len(positions) == 0 or positions.max() < size:
+            return np.asarray(self.base[positions])
+
+        out = np.empty((len(positions), FEATURE_DIM), dtype=np.float32)
+        in_base = positions < size
+        out[in_base] = self.base[positions[in_base]]
+        out[~in_base] = self._extra[positions[~in_base] - size]
+        return out
+
+    def dots(self, queries):
+        """Dot products of one vector, or each row of a batch, with every profile"""
+        if queries.ndim == 1:
+            base, extra = self.base @ queries, self.extra @ queries
+        else:
+            base, extra = queries @ self.base.T, queries @ self.extra.T
+        return np.concatenate([base, extra], axis=-1) if len(extra.T) else base
+
+    def scores(self, vec, inv_norm):
+        """Cosine of one raw vector against every profile in the partition"""
+        return self.dots(vec) * self.inv_norms * inv_norm
+
+
+class MatchEngine:
+    """
+    Scores users against gender-partitioned candidate matrices.
+    The roster provides ids, int8 gender codes, a float32 feature matrix,
+    a scorable mask and an id -> row index (see nitematch.roster.Roster).
+
+    With an AnnConfig, partitions larger than `ann.exact_below` get an LSH
+    index and single-user matching re-scores only the LSH candidates.
+    Smaller partitions, and the batch path in match_rows, always stay exact.
+    """
+
+    def __init__(self, roster, ann=None):
+        self.roster = roster
+        self.ann = ann
+        self._indexes = {}
+
+        base = np.flatnonzero(roster.scorable[:roster.base_size])
+        genders = roster.genders[base]
+        self.partitions = {}
+        for code in (MALE, FEMALE, UNKNOWN_GENDER):
+            rows = base[genders == code]
+            self.partitions[code] = Partition(roster.features, rows, roster.ids[rows].tolist())
+            if self.ann is not None and code != UNKNOWN_GENDER:
+                self._update_index(code, self.partitions[code], 0)
+
+        self.extend(roster, range(roster.base_size, len(roster)))
+
+    def extend(self, roster, new_rows):
+        """Append new roster rows (e.g. a registration) to their gender partitions"""
+        self.roster = roster
+        new_rows = np.asarray(list(new_rows), dtype=np.int64)
+        new_rows = new_rows[roster.scorable[new_rows]] if len(new_rows) else new_rows
+
+        genders = roster.genders[new_rows]
+        for code, partition in self.partitions.items():
+            rows = new_rows[genders == code]
+            if len(rows) == 0:
+                continue
+            start = len(partition)
+            partition.append(rows, roster.ids[rows].tolist(), roster.feature_rows(rows))
+            if self.ann is not None and code != UNKNOWN_GENDER:
+                self._update_index(code, partition, start)
+
+    def _update_index(self, code, partition, start):
+        """
+        Index a partition once it outgrows `ann.exact_below`; after that,
+        positions from `start` on are inserted into the live index
+        """
+        index = self._indexes.get(code)
+        if index is None and len(partition) <= self.ann.exact_below:
+            return
+
+        if index is None:
+            start = 0
+        positions = np.arange(start, len(partition))
+        unit = partition.vectors(positions) * partition.inv_norms[start:, None].astype(np.float32)
+        if index is None:
+            self._indexes[code] = LSHIndex(unit, positions, self.ann)
+        else:
+            index.add(unit, positions)
+
+    def top(self, code, partition, user_id, scores):
+        """Partition positions of the best scores, excluding the user's own row"""
+        own = partition.index.get(user_id)
+        if own is not None:
+            scores = scores.copy()
+            scores[own] = -np.inf
+        return top_k_indices(scores, match_limit(code))
+
+    def as_matches(self, rows, scores):
+        """[{"id": ..., "score": ...}] for roster rows and their scores"""
+        return [
+            {"id": str(self.roster.ids[row]), "score": float(score)}
+            for row, score in zip(rows, scores)
+        ]
+
+    def _approximate(self, index, code, partition, user_id, vec, inv_norm):
+        """Exact re-scoring of LSH candidates; None if too few to fill the list"""
+        candidates = index.query(vec * np.float32(inv_norm))
+        own = partition.index.get(user_id)
+        if own is not None:
+            candidates = candidates[candidates != own]
+        if len(candidates) < match_limit(code):
+            return None
+
+        scores = (partition.vectors(candidates) @ vec) * partition.inv_norms[candidates] * inv_norm
+        idx = top_k_indices(scores, match_limit(code))
+        return self.as_matches(partition.rows[candidates[idx]], scores[idx])
+
+    def match(self, user):
+        """Top matches for one user dict as [{"id": ..., "score": ...}]"""
+        vec = feature_vector(user)
+        if vec is None:
+            return []
+
+        code = gender_code(user.get("gender"))
+        partition = self.partitions[opposite_gender(code)]
+        user_id = user.get("id")
+        inv_norm = inverse_norms(vec)
+
+        index = self._indexes.get(opposite_gender(code))
+        if index is not None:
+            matches = self._approximate(index, code, partition, user_id, vec, inv_norm)
+            if matches is not None:
+                return matches
+
+        scores = partition.scores(vec, inv_norm)
+        idx = self.top(code, partition, user_id, scores)
+        return self.as_matches(partition.rows[idx], scores[idx])
+
+    def score_rows(self, rows):
+        """
+        Yield (row, candidate partition, exact scores against it) for the
+        scorable rows, batched into matrix-matrix products per gender
+        """
+        rows = np.asarray(list(rows), dtype=np.int64)
+        if len(rows) == 0:
+            return
+        rows = rows[self.roster.scorable[rows]]
+        genders = self.roster.genders[rows]
+
+        for code in (MALE, FEMALE, UNKNOWN_GENDER):
+            partition = self.partitions[opposite_gender(code)]
+            group = rows[genders == code]
+            for start in range(0, len(group), BATCH_ROWS):
+                chunk = group[start:start + BATCH_ROWS]
+                queries = self.roster.feature_rows(chunk)
+                block = partition.dots(queries) * partition.inv_norms * inverse_norms(queries)[:, None]
+                for row, scores in zip(chunk.tolist(), block):
+                    yield row, partition, scores
+
+    def match_rows(self, rows):
+        """Top matches for many roster rows (always exact)"""
+        rows = list(rows)
+        results = {}
+        for row, partition, scores in self.score_rows(rows):
+            idx = self.top(self.roster.genders[row], partition, str(self.roster.ids[row]), scores)
+            results[row] = self.as_matches(partition.rows[idx], scores[idx])
+        return [results.get(row, []) for row in rows]
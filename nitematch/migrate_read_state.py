@@ -0,0 +1,70 @@
+"""One-off migration: per-message `read` flags to per-chat read watermarks.
+
+    python -m nitematch.migrate_read_state [--dry-run]
+
+For each participant the watermark `last_read_at.<user_id>` becomes the
+timestamp of the newest message they had marked read, and `unread.<user_id>`
+counts the other participant's messages after it that are not flagged read.
+Chats that already carry a watermark were written by the new code and are
+skipped, so the job is safe to re-run. The old flags are left in place.
+"""
+import sys
+import time
+
+from nitematch.chat import messages_ref
+from nitematch.firebase import init_firestore
+
+MESSAGE_FIELDS = ["sender_id", "timestamp", "read"]
+
+
+def read_state(participants, messages):
+    """(last_read_at, unread) maps for one chat's messages"""
+    last_read_at, unread = {}, {}
+    for user_id in participants:
+        received = [m for m in messages if m.get("sender_id") != user_id and m.get("timestamp")]
+        read = [m["timestamp"] for m in received if m.get("read") is True]
+        watermark = max(read) if read else None
+        if watermark is not None:
+            last_read_at[user_id] = watermark
+        unread[user_id] = sum(
+            1 for m in received
+            if m.get("read") is not True and (watermark is None or m["timestamp"] > watermark)
+        )
+    return last_read_at, unread
+
+
+def migrate_read_state(db, dry_run=False):
+    """Write watermarks and counters for unmigrated chats; returns (scanned, updated)"""
+    scanned = updated = 0
+    writer = None if dry_run else db.bulk_writer()
+
+    for doc in db.collection("chats").select(["participants", "last_read_at"]).stream():
+        scanned += 1
+        chat = doc.to_dict()
+        if chat.get("last_read_at"):
+            continue
+
+        messages = [m.to_dict() for m in messages_ref(db, doc.id).select(MESSAGE_FIELDS).stream()]
+        participants = chat.get("participants") or doc.id.split("_")
+        last_read_at, unread = read_state(participants, messages)
+
+        updated += 1
+        if writer is not None:
+            writer.set(doc.reference, {"last_read_at": last_read_at, "unread": unread}, merge=True)
+
+    if writer is not None:
+        writer.close()
+    return scanned, updated
+
+
+def main():
+    dry_run = "--dry-run" in sys.argv[1:]
+    db = init_firestore()
+    start = time.perf_counter()
+    scanned, updated = migrate_read_state(db, dry_run=dry_run)
+    action = "Would migrate" if dry_run else "Migrated"
+    print(f"{action} {updated} of {scanned} chats in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Unlock-time batch job: score every user once and store their matches.
+
+Run once at UNLOCK_TIME:
+
+    python -m nitematch.precompute
+
+The whole roster is read in a single stream and scored with one batched
+matrix product; results go out through a Firestore BulkWriter. Logins then
+read one `matches/{user_id}` document instead of the entire `users` roster.
+"""
+import time
+
+from nitematch.firebase import init_firestore
+from nitematch.match_store import MATCHES_COLLECTION, get_roster_version, match_document
+from nitematch.matching import MatchEngine
+from nitematch.roster import ROSTER_FIELDS, Roster
+
+
+def stream_users(db):
+    """Read the full roster once, projected to the matching fields"""
+    for doc in db.collection("users").select(ROSTER_FIELDS).stream():
+        data = doc.to_dict()
+        data["id"] = doc.id
+        yield data
+
+
+def precompute_matches(db):
+    """Score all users and bulk-write one match document each; returns the user count"""
+    # Read the version first: a registration during the stream bumps it, so
+    # affected results are flagged stale rather than silently kept
+    roster_version = get_roster_version(db)
+
+    roster = Roster.from_users(stream_users(db))
+    results = MatchEngine(roster).match_rows(range(len(roster)))
+
+    writer = db.bulk_writer()
+    matches_ref = db.collection(MATCHES_COLLECTION)
+    for user_id, matches in zip(roster.ids.tolist(), results):
+        writer.set(matches_ref.document(user_id), match_document(matches, roster_version))
+    writer.close()
+
+    return len(roster)
+
+
+def main():
+    db = init_firestore()
+    start = time.perf_counter()
+    count = precompute_matches(db)
+    print(f"Precomputed matches for {count} users in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
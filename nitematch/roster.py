@@ -0,0 +1,352 @@
+"""Process-wide columnar roster shared by every Streamlit session.
+
+The roster is held as columns instead of a list of Firestore dicts: an id
+array, an int8 gender code array and a float32 psych+interest matrix.
+Display fields (alias, instagram, match message) live in a side table that
+is only loaded for the users actually shown on screen.
+
+The first load streams the whole `users` collection, or memory-maps the
+live on-disk snapshot when a snapshot directory is configured (see
+nitematch.snapshot). After that, a refresh (on TTL expiry or after a
+registration) only queries documents whose `created_at` is at or past the
+newest one already cached, so keeping the roster current costs a handful of
+reads instead of a full re-stream.
+"""
+import threading
+import time
+
+import numpy as np
+
+from nitematch.matching import FEATURE_DIM, MatchEngine, feature_vector, gender_code
+from nitematch.snapshot import current_snapshot_name, load_snapshot
+from nitematch.topk import TopKTable
+
+DEFAULT_TTL_SECONDS = 300
+# Incremental refreshes can't see edits or deletions, so re-stream occasionally
+DEFAULT_FULL_REFRESH_SECONDS = 3600
+
+# Roster streams project down to what matching needs; display fields are
+# fetched separately, and only for the handful of users shown on screen
+ROSTER_FIELDS = ["gender", "answers", "features", "features_version", "created_at"]
+DISPLAY_FIELDS = ["alias", "instagram", "share_instagram", "match_message"]
+
+
+def _columns(users):
+    """Split user dicts into (ids, genders, features, scorable) arrays"""
+    n = len(users)
+    ids = np.array([u["id"] for u in users], dtype=str)
+    genders = np.fromiter((gender_code(u.get("gender")) for u in users), dtype=np.int8, count=n)
+    features = np.zeros((n, FEATURE_DIM), dtype=np.float32)
+    scorable = np.zeros(n, dtype=bool)
+
+    for row, user in enumerate(users):
+        vec = feature_vector(user)
+        if vec is not None:
+            features[row] = vec
+            scorable[row] = True
+
+    return ids, genders, features, scorable
+
+
+def _gender_order(genders, scorable):
+    """
+    Gender-major row order, scorable rows first, so each gender's candidates
+    form one contiguous block that MatchEngine partitions slice without
+    copying. The sort is stable: within a gender rows keep their order, so
+    ties break the same way.
+    """
+    return np.lexsort((~scorable, genders))
+
+
+class Roster:
+    """
+    Immutable columnar roster snapshot; updates return a new snapshot.
+
+    `features` is the base matrix (memory-mapped when loaded from a
+    snapshot) and is never copied. Rows appended by merged() keep their
+    features in the small `appended_features` matrix; read any row's
+    features with feature_rows().
+    """
+
+    def __init__(self, ids, genders, features, scorable, appended_features=None):
+        self.ids = ids
+        self.genders = genders
+        self.features = features
+        self.scorable = scorable
+        self.base_size = len(features)
+        self.appended_features = (
+            np.empty((0, FEATURE_DIM), dtype=np.float32) if appended_features is None else appended_features
+        )
+        self.index = {uid: row for row, uid in enumerate(ids.tolist())}
+
+    @classmethod
+    def from_users(cls, users):
+        """Build a roster from user dicts (each with an "id")"""
+        ids, genders, features, scorable = _columns(list(users))
+        order = _gender_order(genders, scorable)
+        return cls(ids[order], genders[order], features[order], scorable[order])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def feature_rows(self, rows):
+        """Feature vectors of these roster rows, base or appended"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0 or rows.max() < self.base_size:
+            return np.asarray(self.features[rows])
+
+        out = np.empty((len(rows), FEATURE_DIM), dtype=np.float32)
+        in_base = rows < self.base_size
+        out[in_base] = self.features[rows[in_base]]
+        out[~in_base] = self.appended_features[rows[~in_base] - self.base_size]
+        return out
+
+    def columns(self):
+        """
+        (ids, genders, features, scorable) in gender order with every row's
+        features in one matrix, ready to be written as a snapshot
+        """
+        order = _gender_order(self.genders, self.scorable)
+        return self.ids[order], self.genders[order], self.feature_rows(order), self.scorable[order]
+
+    def merged(self, users):
+        """
+        New roster with these users appended. Users already in the roster are
+        skipped; edits are picked up by the next full load.
+        """
+        users = [u for u in users if u["id"] not in self.index]
+        if not users:
+            return self
+
+        ids, genders, features, scorable = _columns(users)
+        return Roster(
+            np.concatenate([self.ids, ids]),
+            np.concatenate([self.genders, genders]),
+            self.features,
+            np.concatenate([self.scorable, scorable]),
+            appended_features=np.concatenate([self.appended_features, features]),
+        )
+
+
+class DisplayTable:
+    """Display fields keyed by user id, fetched on demand with one get_all"""
+
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        self._rows = {}
+
+    def get_many(self, user_ids, timeout=None):
+        """Display dicts (with "id") for these users; unknown ids are left out"""
+        with self._lock:
+            missing = [uid for uid in dict.fromkeys(user_ids) if uid not in self._rows]
+
+        if missing:
+            refs = [self._db.collection("users").document(uid) for uid in missing]
+            loaded = {}
+            for doc in self._db.get_all(refs, field_paths=DISPLAY_FIELDS, timeout=timeout):
+                if doc.exists:
+                    data = doc.to_dict()
+                    data["id"] = doc.id
+                    loaded[doc.id] = data
+            with self._lock:
+                self._rows.update(loaded)
+
+        with self._lock:
+            return {uid: self._rows[uid] for uid in user_ids if uid in self._rows}
+
+    def get(self, user_id):
+        """Display dict for one user, or None"""
+        return self.get_many([user_id]).get(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._rows = {}
+
+
+class RosterCache:
+    """Thread-safe roster snapshot with TTL, created_at watermark and counters"""
+
+    def __init__(self, db, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 full_refresh_seconds=DEFAULT_FULL_REFRESH_SECONDS, snapshot_dir=None,
+                 ann=None):
+        self._db = db
+        self.ttl_seconds = ttl_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+        self.snapshot_dir = snapshot_dir
+        self.ann = ann
+        self.display = DisplayTable(db)
+
+        self._lock = threading.Lock()
+        self._roster = Roster.from_users([])
+        self._engine = None
+        self._topk = None
+        self._watermark = None
+        self._refreshed_at = None
+        self._full_loaded_at = None
+        self._snapshot_name = None
+        self._stale = True
+
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "full_loads": 0,
+            "snapshot_loads": 0,
+            "incremental_refreshes": 0,
+            "docs_read": 0,
+            "last_refresh_seconds": 0.0,
+            "total_refresh_seconds": 0.0,
+        }
+
+    def roster(self):
+        """Current columnar roster snapshot"""
+        with self._lock:
+            self._ensure_fresh()
+            return self._roster
+
+    def engine(self):
+        """MatchEngine for the current roster, rebuilt only when the roster changes"""
+        with self._lock:
+            self._ensure_fresh()
+            return self._current_engine()
+
+    def top_matches(self, user):
+        """
+        A user's matches from the incrementally maintained top-k table.
+        Users not in the roster yet (or any user when the LSH index is on)
+        are scored directly.
+        """
+        with self._lock:
+            self._ensure_fresh()
+            engine = self._current_engine()
+            row = self._roster.index.get(user.get("id"))
+            if row is None or self.ann is not None:
+                return engine.match(user)
+
+            if self._topk is None:
+                self._topk = TopKTable(engine)
+            return self._topk.lookup(engine, row)
+
+    def register(self, user_id, data):
+        """Fold a new registration into the roster and top-k lists without re-reading"""
+        with self._lock:
+            if self._full_loaded_at is None or user_id in self._roster.index:
+                return
+            self._set_roster(self._roster.merged([dict(data, id=user_id)]), appended=True)
+
+    def mark_stale(self):
+        """Force an incremental refresh on the next read (e.g. after a registration)"""
+        with self._lock:
+            self._stale = True
+
+    def stats(self):
+        """Copy of the hit/miss and refresh-duration counters"""
+        with self._lock:
+            return dict(self._stats, size=len(self._roster))
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        expired = self._refreshed_at is None or now - self._refreshed_at > self.ttl_seconds
+        if not self._stale and not expired:
+            self._stats["hits"] += 1
+            return
+
+        self._stats["misses"] += 1
+        start = time.perf_counter()
+
+        needs_full = (
+            self._full_loaded_at is None
+            or self._watermark is None
+            or now - self._full_loaded_at > self.full_refresh_seconds
+            or self._snapshot_swapped()
+        )
+        if needs_full:
+            roster, catch_up = self._load_base()
+            self._set_roster(roster, appended=False)
+            self.display.clear()
+            self._full_loaded_at = now
+            self._stats["full_loads"] += 1
+        else:
+            catch_up = True
+
+        # Snapshots and earlier loads lag the live collection; catch up on anyone newer
+        if catch_up and self._watermark is not None:
+            # >= rather than >: documents sharing the watermark timestamp may
+            # have committed after the last read; re-reading them is harmless
+            query = (
+                self._db.collection("users")
+                .where("created_at", ">=", self._watermark)
+                .select(ROSTER_FIELDS)
+            )
+            roster = self._roster.merged(
+                u for u in self._stream(query) if u["id"] not in self._roster.index
+            )
+            self._set_roster(roster, appended=True)
+            self._stats["incremental_refreshes"] += 1
+
+        self._refreshed_at = now
+        self._stale = False
+
+        elapsed = time.perf_counter() - start
+        self._stats["last_refresh_seconds"] = elapsed
+        self._stats["total_refresh_seconds"] += elapsed
+
+    def _current_engine(self):
+        if self._engine is None:
+            self._engine = MatchEngine(self._roster, ann=self.ann)
+        return self._engine
+
+    def _set_roster(self, roster, appended):
+        """
+        Swap in a new roster. Appended rows go straight into the engine's
+        gender partitions and are folded into the top-k table in O(N) each;
+        anything else drops both for a lazy rebuild.
+        """
+        if roster is self._roster:
+            return
+
+        previous = len(self._roster)
+        self._roster = roster
+
+        if not appended:
+            self._engine = None
+            self._topk = None
+            return
+
+        new_rows = range(previous, len(roster))
+        if self._engine is not None:
+            self._engine.extend(roster, new_rows)
+        if self._topk is not None:
+            self._topk.extend(self._current_engine(), new_rows)
+
+    def _snapshot_swapped(self):
+        """Check whether a newer on-disk snapshot went live since the last load"""
+        if not self.snapshot_dir:
+            return False
+        return current_snapshot_name(self.snapshot_dir) != self._snapshot_name
+
+    def _load_base(self):
+        """Full roster: the live mmap snapshot if configured, else a full stream"""
+        if self.snapshot_dir:
+            snapshot = load_snapshot(self.snapshot_dir)
+            if snapshot is not None:
+                self._snapshot_name = snapshot.name
+                self._watermark = snapshot.watermark
+                self._stats["snapshot_loads"] += 1
+                return Roster(*snapshot.columns), True
+
+        self._watermark = None
+        query = self._db.collection("users").select(ROSTER_FIELDS)
+        return Roster.from_users(self._stream(query)), False
+
+    def _stream(self, query):
+        """Yield user dicts from a query, advancing the created_at watermark"""
+        for doc in query.stream():
+            data = doc.to_dict()
+            data["id"] = doc.id
+            self._stats["docs_read"] += 1
+
+            created_at = data.get("created_at")
+            if created_at is not None and (self._watermark is None or created_at > self._watermark):
+                self._watermark = created_at
+            yield data
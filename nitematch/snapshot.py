@@ -0,0 +1,146 @@
+"""Versioned on-disk roster snapshots that workers memory-map read-only.
+
+Layout under the snapshot directory:
+
+    CURRENT                 name of the live snapshot (swapped atomically)
+    v12-<ns>/
+        manifest.json       version, row count, created_at watermark
+        ids.npy             fixed-width unicode user ids
+        genders.npy         int8 gender codes
+        features.npy        float32 (rows, 15) psych+interest matrix
+        scorable.npy        bool mask of rows with usable answers
+
+Every Streamlit process behind the load balancer maps the same files, so
+startup is a few page faults instead of a full `users` stream and the
+feature matrix is shared through the page cache. Build one with:
+
+    python -m nitematch.snapshot <snapshot_dir>
+"""
+from datetime import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+POINTER_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+COLUMNS = ("ids", "genders", "features", "scorable")
+# Older snapshots kept around for workers that still have them mapped
+KEEP_SNAPSHOTS = 3
+
+
+class Snapshot:
+    """A loaded snapshot: memory-mapped roster columns plus the manifest"""
+
+    def __init__(self, name, columns, manifest):
+        self.name = name
+        self.columns = columns
+        self.manifest = manifest
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    @property
+    def watermark(self):
+        """Newest created_at in the snapshot, for incremental refreshes on top"""
+        value = self.manifest.get("watermark")
+        return datetime.fromisoformat(value) if value else None
+
+
+def current_snapshot_name(directory):
+    """Name of the live snapshot, or None if none was written yet"""
+    try:
+        with open(os.path.join(directory, POINTER_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(directory, roster, version, watermark=None):
+    """Write a roster's columns and atomically make them the live snapshot; returns its name"""
+    os.makedirs(directory, exist_ok=True)
+    name = f"v{version}-{time.time_ns()}"
+
+    # Build in a temp dir next to the target so the rename stays on one filesystem
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=directory)
+    os.chmod(tmp_dir, 0o755)
+    for column, values in zip(COLUMNS, roster.columns()):
+        np.save(os.path.join(tmp_dir, f"{column}.npy"), values)
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "rows": len(roster),
+        "watermark": watermark.isoformat() if watermark else None,
+        "written_at": datetime.now().astimezone().isoformat(),
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+
+    os.replace(tmp_dir, os.path.join(directory, name))
+
+    pointer_tmp = os.path.join(directory, f".{POINTER_FILE}.tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(directory, POINTER_FILE))
+
+    _prune(directory, keep=name)
+    return name
+
+
+def load_snapshot(directory):
+    """Memory-map the live snapshot read-only, or return None if there isn't one"""
+    name = current_snapshot_name(directory)
+    if name is None:
+        return None
+
+    path = os.path.join(directory, name)
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        return None
+
+    columns = [np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r") for column in COLUMNS]
+    return Snapshot(name, columns, manifest)
+
+
+def _prune(directory, keep):
+    """Delete all but the newest KEEP_SNAPSHOTS snapshots (mapped files stay valid on POSIX)"""
+    names = sorted(
+        (n for n in os.listdir(directory) if n.startswith("v") and n != keep),
+        key=lambda n: os.path.getmtime(os.path.join(directory, n)),
+    )
+    for name in names[:max(0, len(names) - (KEEP_SNAPSHOTS - 1))]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def main():
+    from nitematch.firebase import init_firestore
+    from nitematch.match_store import get_roster_version
+    from nitematch.precompute import stream_users
+    from nitematch.roster import Roster
+
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m nitematch.snapshot <snapshot_dir>")
+
+    db = init_firestore()
+    start = time.perf_counter()
+    version = get_roster_version(db)
+
+    users = list(stream_users(db))
+    stamps = [u["created_at"] for u in users if u.get("created_at") is not None]
+    name = write_snapshot(sys.argv[1], Roster.from_users(users), version, max(stamps, default=None))
+
+    print(f"Wrote snapshot {name} with {len(users)} users in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Every roster member's top-k list, kept current as people register.
+
+The table is built once with the batched exact scorer. After that a
+newcomer costs one O(N) scoring pass: their score against the opposite
+pool yields their own list, and only the lists whose current k-th best
+score they beat are updated. Newcomers are appended to the roster, so on a
+tie they rank after existing candidates, exactly as a full recompute would.
+"""
+import numpy as np
+
+from nitematch.matching import match_limit, opposite_gender
+
+MAX_MATCHES = 5
+
+
+class TopKTable:
+    """Per-row top-k candidate rows and scores, padded with -1 / -inf"""
+
+    def __init__(self, engine):
+        self.rows = np.empty((0, MAX_MATCHES), dtype=np.int64)
+        self.scores = np.empty((0, MAX_MATCHES), dtype=np.float64)
+        self.limits = np.empty(0, dtype=np.int64)
+        self.extend(engine, range(len(engine.roster)), rebuild=True)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def extend(self, engine, new_rows, rebuild=False):
+        """
+        Add appended roster rows. With rebuild=True the rows are scored in
+        one batch and nobody else's list is touched (initial build).
+        Returns the rows whose lists changed.
+        """
+        new_rows = list(new_rows)
+        if not new_rows:
+            return []
+
+        genders = engine.roster.genders
+        self.rows = np.vstack([self.rows, np.full((len(new_rows), MAX_MATCHES), -1, dtype=np.int64)])
+        self.scores = np.vstack([self.scores, np.full((len(new_rows), MAX_MATCHES), -np.inf)])
+        self.limits = np.concatenate([
+            self.limits,
+            np.array([match_limit(genders[row]) for row in new_rows], dtype=np.int64),
+        ])
+
+        changed = set()
+        for row, partition, scores in engine.score_rows(new_rows):
+            idx = engine.top(genders[row], partition, str(engine.roster.ids[row]), scores)
+            self.rows[row, :len(idx)] = partition.rows[idx]
+            self.scores[row, :len(idx)] = scores[idx]
+            changed.add(row)
+
+        if not rebuild:
+            # Newcomers were fully scored above, so only older rows need offers
+            existing = np.ones(len(self.rows), dtype=bool)
+            existing[new_rows] = False
+            for row in new_rows:
+                changed.update(self._offer(engine, row, existing))
+
+        return sorted(changed)
+
+    def _offer(self, engine, newcomer, existing):
+        """Insert the newcomer into every existing list whose k-th best score it beats"""
+        code = engine.roster.genders[newcomer]
+        own = engine.partitions.get(code)
+        position = own.index.get(str(engine.roster.ids[newcomer])) if own is not None else None
+        if position is None:
+            return []
+
+        vec = own.vectors([position])[0]
+        inv_norm = own.inv_norms[position]
+        beaten = []
+        for seeker_code, seekers in engine.partitions.items():
+            if opposite_gender(seeker_code) != code or len(seekers) == 0:
+                continue
+
+            # Score from each seeker's side so values match a full recompute bit for bit
+            scores = seekers.dots(vec) * inv_norm * seekers.inv_norms
+            rows = seekers.rows
+            kth = self.scores[rows, self.limits[rows] - 1]
+            # Strictly greater: on a tie the earlier roster row keeps its place
+            hit = existing[rows] & (scores > kth)
+
+            for row, score in zip(rows[hit].tolist(), scores[hit].tolist()):
+                limit = self.limits[row]
+                pos = int(np.count_nonzero(self.scores[row, :limit] >= score))
+                self.rows[row, pos + 1:limit] = self.rows[row, pos:limit - 1].copy()
+                self.scores[row, pos + 1:limit] = self.scores[row, pos:limit - 1].copy()
+                self.rows[row, pos] = newcomer
+                self.scores[row, pos] = score
+                beaten.append(row)
+
+        return beaten
+
+    def lookup(self, engine, row):
+        """[{"id": ..., "score": ...}] for one roster row"""
+        limit = self.limits[row]
+        rows = self.rows[row, :limit]
+        keep = rows >= 0
+        return engine.as_matches(rows[keep], self.scores[row, :limit][keep])
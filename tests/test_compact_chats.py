@@ -0,0 +1,105 @@
+"""Runs one chat compaction against a real Firestore client whose RPCs are
+served from memory, so reference and query types are checked for real."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import BaseQuery
+from google.cloud.firestore_v1.document import DocumentReference
+from google.cloud.firestore_v1.transaction import Transaction
+
+from nitematch import buckets, compact_chats
+
+T0 = datetime(2026, 2, 14, tzinfo=timezone.utc)
+
+
+class MemoryWriter:
+    """Stands in for a BulkWriter; applies writes to the store, in order"""
+
+    def __init__(self, store):
+        self.store = store
+        self.flushed_before_delete = True
+        self._pending = 0
+
+    def set(self, ref, data):
+        self.store[ref.path] = data
+        self._pending += 1
+
+    def flush(self):
+        self._pending = 0
+
+    def delete(self, ref):
+        if self._pending:
+            self.flushed_before_delete = False
+        self.store.pop(ref.path, None)
+
+    def close(self):
+        self.flush()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = firestore.Client(project="test", credentials=AnonymousCredentials())
+    store = {}
+
+    def snapshot(ref, data):
+        now = T0
+        return firestore.DocumentSnapshot(ref, data, data is not None, now, now, now)
+
+    def document_get(self, field_paths=None, transaction=None, **kwargs):
+        return snapshot(self, store.get(self.path))
+
+    def query_stream(self, transaction=None, **kwargs):
+        prefix = self._parent._path
+        for path in sorted(store):
+            parts = tuple(path.split("/"))
+            if parts[:-1] == prefix:
+                yield snapshot(self._parent.document(parts[-1]), store[path])
+
+    def transaction_set(self, ref, data, merge=False):
+        store[ref.path] = {**store.get(ref.path, {}), **data} if merge else data
+
+    monkeypatch.setattr(DocumentReference, "get", document_get)
+    monkeypatch.setattr(BaseQuery, "stream", query_stream)
+    monkeypatch.setattr(Transaction, "_begin", lambda self, retry_id=None: setattr(self, "_id", b"txn"))
+    monkeypatch.setattr(Transaction, "_commit", lambda self: self._clean_up() or [])
+    monkeypatch.setattr(Transaction, "_rollback", lambda self: self._clean_up())
+    monkeypatch.setattr(Transaction, "set", transaction_set)
+
+    client.store = store
+    return client
+
+
+def test_compacts_a_subcollection_chat(db):
+    store = db.store
+    store["chats/a_b"] = {"participants": ["a", "b"], "last_read_at": {"b": T0 + timedelta(minutes=1)}}
+    for i in range(5):
+        store[f"chats/a_b/messages/m{i}"] = {
+            "sender_id": "a", "text": f"hi {i}", "timestamp": T0 + timedelta(minutes=i)
+        }
+    # Legacy message without a timestamp must still be moved, not orphaned
+    store["chats/a_b/messages/z"] = {"sender_id": "b", "text": "old"}
+
+    writer = MemoryWriter(store)
+    assert compact_chats.compact_chat(db, "a_b", writer, bucket_size=4) == 6
+
+    chat = store["chats/a_b"]
+    assert chat["layout"] == buckets.LAYOUT
+    assert (chat["bucket_seq"], chat["bucket_fill"], chat["bucket_bytes"]) == (0, 0, 0)
+    assert chat["unread"] == {"a": 0, "b": 3}
+
+    assert not any("/messages/" in path for path in store)
+    assert writer.flushed_before_delete
+    moved = store["chats/a_b/buckets/-2"]["messages"] + store["chats/a_b/buckets/-1"]["messages"]
+    assert [m["id"] for m in moved] == ["z", "m0", "m1", "m2", "m3", "m4"]
+    assert store["chats/a_b/buckets/-2"]["seq"] == -2
+
+    # Already bucketed: skipped
+    assert compact_chats.compact_chat(db, "a_b", writer) is None
+
+
+def test_pack_rolls_over_on_size():
+    big = {"id": "m", "sender_id": "a", "text": "x" * 1000, "timestamp": T0}
+    chunks = buckets.pack([big] * 10, bucket_size=100, max_bytes=3 * buckets.message_bytes(big))
+    assert [len(c) for c in chunks] == [3, 3, 3, 1]